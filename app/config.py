@@ -8,5 +8,10 @@ class AppConfig(BaseModel):
     binance_key: str | None = os.getenv("BINANCE_KEY")
     binance_secret: str | None = os.getenv("BINANCE_SECRET")
     live_enabled: bool = os.getenv("LIVE_ENABLED", "false").lower() == "true"
+    # исполнение ордеров
+    binance_base_url: str = os.getenv("BINANCE_BASE_URL", "https://api.binance.com")
+    binance_ws_url: str = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443/ws")
+    binance_recv_window: int = int(os.getenv("BINANCE_RECV_WINDOW", "5000"))
+    exchange_stub: bool = os.getenv("EXCHANGE_STUB", "false").lower() == "true"  # локальная заглушка биржи
 
 config = AppConfig()
@@ -1,16 +1,73 @@
+import asyncio
 from fastapi import FastAPI
-from app.routers import health, market, settings, trade
-from app.services.tick import run_tick   # <— добавили
+from app.routers import health, market, settings, trade, trades, portfolios, events
+from app.services.leader import leadership
+from app.services.events import bus
+from app.services.execution import get_engine, close_engine, live_allowed
+from app.services.prices import price_cache
+from app.services.candles import candle_feed
+from app.services.risk import risk_engine
+from app.services.tick import flatten_portfolio, sync_risk
+from app.services.portfolios import DEFAULT_ID, Portfolio
+from app.utils.storage import load_settings
 
 app = FastAPI(title="Million Path Backend", version="0.2.0")
 
 app.include_router(health.router)
 app.include_router(market.router)
 app.include_router(settings.router)
+app.include_router(settings.scoped)
 app.include_router(trade.router)
+app.include_router(trade.scoped)
+app.include_router(trades.router)
+app.include_router(trades.scoped)
+app.include_router(portfolios.router)
+app.include_router(events.router)
+
+def _on_breach(loop):
+    def cb(pid, kill):
+        # пробой может прийти и из threadpool (ручное закрытие) — задачу ставим в цикл потокобезопасно;
+        # запись в SQLite (запрос тика) — тоже задачей, в потоке, а не прямо в цикле
+        if leadership.is_leader:
+            loop.call_soon_threadsafe(lambda: loop.create_task(flatten_portfolio(pid, kill)))
+        else:
+            # торгует только лидер: просим внеочередной тик, он увидит kill switch в сводке/по ценам
+            loop.call_soon_threadsafe(lambda: loop.create_task(leadership.request_tick()))
+    return cb
+
+@app.on_event("startup")
+async def startup():
+    # события всех воркеров — через общую ленту, чтобы /events на любом воркере видел тики лидера
+    await bus.start()
+    # общий кэш цен: bulk bookTicker в фоне ведёт только лидер, остальные читают его снимок
+    leadership.on_elected.append(price_cache.start)
+    leadership.on_demoted.append(price_cache.stop)
+    # риск: каждое обновление цены сразу переоценивает позиции; пробой лимита — закрытие без ожидания тика
+    leadership.on_elected.append(sync_risk)
+    price_cache.listeners.append(risk_engine.on_price)
+    risk_engine.on_breach.append(_on_breach(asyncio.get_running_loop()))
+    await leadership.start()
+    # прогреваем соединение с биржей заранее, чтобы первый ордер не платил за TLS/синхронизацию
+    if live_allowed():
+        try:
+            await get_engine(load_settings(Portfolio(DEFAULT_ID).f_set).allowed_symbols)
+        except Exception:
+            pass  # поднимется лениво при первом ордере
+
+@app.on_event("shutdown")
+async def shutdown():
+    await leadership.stop()
+    await bus.stop()
+    await price_cache.stop()
+    await candle_feed.close()
+    await close_engine()
 
 # Технический тик-эндпоинт (один проход стратегии по списку символов)
 @app.post("/tick")
-def tick():
-    result = run_tick()
-    return {"ok": True, **result}
+async def tick():
+    if leadership.is_leader:
+        result = await leadership.run_tick()
+        return {"ok": True, **result}
+    # не лидер: ставим запрос, лидер выполнит его в течение секунды
+    await leadership.request_tick()
+    return {"ok": True, "queued": True, "leader": leadership.lease.leader}
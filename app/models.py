@@ -10,6 +10,7 @@ class Settings(BaseModel):
     max_open_positions: int = Field(1, ge=0, description="Макс. число одновременно открытых позиций")
     risk_per_trade_pct: float = Field(0.5, ge=0, le=100, description="Риск на сделку, % от депозита")
     max_daily_loss_usdc: float = Field(25.0, ge=0, description="Дневной лимит потерь в USDC")
+    stop_distance_pct: float = Field(1.0, gt=0, description="Дистанция стопа в % для размера позиции")
     return_to_usdc: bool = True
     news_pause_enabled: bool = True
     allowed_symbols: List[str] = []
@@ -34,6 +35,13 @@ class PreviewResponse(BaseModel):
     take_profit_price: float | None = None
     notes: str | None = None
 
+class BatchPreviewRequest(BaseModel):
+    items: List[PreviewRequest] = Field(..., min_length=1, max_length=200)
+
+class BatchPreviewResponse(BaseModel):
+    items: List[PreviewResponse]
+    prices_age_sec: float | None = None  # возраст кэша bookTicker
+
 class MarketOrderRequest(BaseModel):
     symbol: str
     side: Literal["BUY", "SELL"]
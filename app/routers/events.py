@@ -0,0 +1,53 @@
+from __future__ import annotations
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.routers.settings import _auth_ok
+from app.services.events import bus
+
+router = APIRouter(tags=["events"])
+
+HEARTBEAT_SEC = 15.0
+
+@router.get("/events")
+async def events(
+    request: Request,
+    portfolio: str | None = None,
+    last_event_id: int | None = None,
+    token: str | None = None,
+    authorization: str | None = Header(default=None),
+    last_event_id_header: str | None = Header(default=None, alias="Last-Event-ID"),
+):
+    """
+    Server-Sent Events: tick, position.open, position.close, summary (дельты), settings.
+    Возобновление — по заголовку Last-Event-ID (EventSource шлёт его сам) или ?last_event_id=.
+    EventSource не умеет заголовки, поэтому токен можно передать и как ?token=.
+    """
+    if not _auth_ok(authorization or (f"Bearer {token}" if token else None)):
+        raise HTTPException(401)
+    if last_event_id is None and last_event_id_header and last_event_id_header.isdigit():
+        last_event_id = int(last_event_id_header)
+
+    sub, replay, gap = await bus.subscribe(portfolio, last_event_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            if gap:
+                # буфер уже не содержит пропущенное — клиент должен перечитать состояние через REST
+                yield f"id: {bus.last_id}\nevent: resync\ndata: {{}}\n\n"
+            for ev in replay:
+                yield ev.sse()
+            while not await request.is_disconnected():
+                batch = await sub.get(HEARTBEAT_SEC)
+                if sub.dropped:
+                    yield f"event: overflow\ndata: {{\"dropped\": {sub.dropped}}}\n\n"
+                    sub.dropped = 0
+                if not batch:
+                    yield ": ping\n\n"
+                for ev in batch:
+                    yield ev.sse()
+        finally:
+            bus.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,6 +1,8 @@
 import time
 from fastapi import APIRouter
 from app.config import config
+from app.services.leader import leadership
+from app.services.scheduler import symbol_scheduler
 
 router = APIRouter()
 START = time.time()
@@ -11,5 +13,7 @@ def health():
         "ok": True,
         "uptime_sec": round(time.time() - START, 2),
         "mode": config.trade_mode,
-        "quote": config.quote_asset
+        "quote": config.quote_asset,
+        "leadership": leadership.lease.info(),
+        "scheduler": symbol_scheduler.status()
     }
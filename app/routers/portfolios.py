@@ -0,0 +1,69 @@
+from __future__ import annotations
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel
+from app.routers.settings import SettingsModel, _auth_ok, _read_json, _write_json
+from app.services.portfolios import (
+    DEFAULT_ID, create_portfolio, delete_portfolio, get_portfolio, list_portfolios, portfolio_lock, valid_id,
+)
+from app.services.risk import risk_engine
+
+router = APIRouter(prefix="/portfolios", tags=["portfolios"])
+
+class PortfolioCreate(BaseModel):
+    id: str
+    settings: SettingsModel | None = None   # если нет — копия copy_from (или дефолты)
+    copy_from: str | None = None
+
+@router.get("")
+def list_all(authorization: str | None = Header(default=None)):
+    if not _auth_ok(authorization): raise HTTPException(401)
+    out = []
+    for pf in list_portfolios():
+        st = _read_json(pf.f_set, {})
+        sm = _read_json(pf.f_sum, {})
+        out.append({
+            "id": pf.id,
+            "trade_mode": st.get("trade_mode", "paper"),
+            "strategy": st.get("strategy", "sma_cross"),
+            "timeframe": st.get("timeframe", "1m"),
+            "allowed_symbols": st.get("allowed_symbols", []),
+            "open_count": sm.get("open_count", 0),
+            "realized_pnl_usdc_total": sm.get("realized_pnl_usdc_total", 0.0),
+            "effective_max_usdc_exposure": sm.get("effective_max_usdc_exposure"),
+        })
+    return out
+
+@router.post("")
+def create(body: PortfolioCreate, authorization: str | None = Header(default=None)):
+    if not _auth_ok(authorization): raise HTTPException(401)
+    if not valid_id(body.id):
+        raise HTTPException(400, detail="id must match [A-Za-z0-9_-]{1,40}")
+    if get_portfolio(body.id):
+        raise HTTPException(409, detail="portfolio already exists")
+    if body.settings is not None:
+        st = body.settings.dict()
+    elif body.copy_from:
+        src = get_portfolio(body.copy_from)
+        if src is None:
+            raise HTTPException(404, detail="copy_from portfolio not found")
+        st = {**SettingsModel().dict(), **_read_json(src.f_set, {})}
+    else:
+        st = SettingsModel().dict()
+    st.pop("effective_max_usdc_exposure", None)
+    pf = create_portfolio(body.id)
+    _write_json(pf.f_set, st)
+    return {"id": pf.id, "settings": st}
+
+@router.delete("/{pid}")
+def delete(pid: str, authorization: str | None = Header(default=None)):
+    if not _auth_ok(authorization): raise HTTPException(401)
+    if pid == DEFAULT_ID:
+        raise HTTPException(400, detail="default portfolio cannot be deleted")
+    pf = get_portfolio(pid)
+    if pf is None:
+        raise HTTPException(404, detail="portfolio not found")
+    # под блокировкой: идущий тик допишет файлы до удаления, следующий увидит, что портфеля нет
+    with portfolio_lock(pf):
+        delete_portfolio(pid)
+        risk_engine.reset(pid)
+    return {"ok": True, "id": pid}
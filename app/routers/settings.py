@@ -1,16 +1,18 @@
 from __future__ import annotations
-from fastapi import APIRouter, Header, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 from pydantic import BaseModel
 from pathlib import Path
 import json, os
 from datetime import datetime, timezone
+from app.services.portfolios import DB, Portfolio, portfolio_dep, portfolio_lock
+from app.utils.storage import write_json_atomic
+from app.services.events import bus
+from app.services.risk import risk_engine, cache_marks
 
 router = APIRouter(prefix="/settings", tags=["settings"])
+scoped = APIRouter(prefix="/portfolios/{pid}/settings", tags=["settings"])
 
-ROOT = Path(__file__).resolve().parents[1]
-DB = ROOT / "db"; DB.mkdir(exist_ok=True)
-F_SET = DB / "settings.json"
-F_SUM = DB / "trades_summary.json"
+DB.mkdir(exist_ok=True)
 
 def _read_json(p: Path, default):
     if not p.exists(): return default
@@ -19,7 +21,7 @@ def _read_json(p: Path, default):
     except Exception: return default
 
 def _write_json(p: Path, data):
-    with p.open("w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(p, data, indent=2)
 
 def _auth_ok(authorization: str | None) -> bool:
     if not authorization or not authorization.lower().startswith("bearer "): return False
@@ -33,6 +35,7 @@ class SettingsModel(BaseModel):
     max_open_positions: int = 1
     risk_per_trade_pct: float = 0.5
     max_daily_loss_usdc: float = 25.0
+    stop_distance_pct: float = 1.0   # для размера входа из risk_per_trade_pct
     return_to_usdc: bool = True
     news_pause_enabled: bool = True
     allowed_symbols: list[str] = []
@@ -41,19 +44,23 @@ class SettingsModel(BaseModel):
     # автоторговля:
     autotrade_enabled: bool = False
     tick_interval_sec: int = 30
-    timeframe: str = "1m"   # 1m/5m/15m
+    universe_top_n: int = 0          # >0 — добавить к allowed_symbols top-N по ликвидности (автообновление)
+    universe_quote: str = "USDC"
+    strategy: str = "sma_cross"
+    timeframe: str = "1m"   # 1m/3m/5m/15m/30m/1h/2h/4h/6h/8h/12h/1d/1w — собирается из 1m
     # вычисляемое:
     effective_max_usdc_exposure: float | None = None
 
-def _effective_exposure(base: float) -> float:
-    s = _read_json(F_SUM, {})
+def _effective_exposure(pf: Portfolio, base: float) -> float:
+    s = _read_json(pf.f_sum, {})
     adj = float(s.get("adjustment_usdc", 0.0))
     return round(float(base) + adj, 6)
 
 @router.get("")
-def get_settings(authorization: str | None = Header(default=None)):
+@scoped.get("")
+def get_settings(pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    raw = _read_json(F_SET, {})
+    raw = _read_json(pf.f_set, {})
     base = raw.get("max_usdc_exposure", 100.0)
     return SettingsModel(**{
         **{
@@ -61,32 +68,40 @@ def get_settings(authorization: str | None = Header(default=None)):
             for k in SettingsModel.__fields__.keys()
             if k not in ("effective_max_usdc_exposure",)
         },
-        "effective_max_usdc_exposure": _effective_exposure(base)
+        "effective_max_usdc_exposure": _effective_exposure(pf, base)
     })
 
 @router.put("")
-def put_settings(body: SettingsModel, authorization: str | None = Header(default=None)):
+@scoped.put("")
+def put_settings(body: SettingsModel, pf: Portfolio = Depends(portfolio_dep),
+                 authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
     out = body.dict()
     out.pop("effective_max_usdc_exposure", None)
-    _write_json(F_SET, out)
+    with portfolio_lock(pf):
+        _write_json(pf.f_set, out)
 
-    sumfile = _read_json(F_SUM, {
-        "open_count": 0, "closed_count": 0,
-        "realized_pnl_usdc_total": 0.0, "realized_pnl_usdc_today": 0.0,
-        "win_rate": 0.0, "avg_pnl_usdc": 0.0,
-        "max_drawdown_usdc": 0.0,
-        "base_exposure_usdc": body.max_usdc_exposure,
-        "adjustment_usdc": 0.0,
-        "effective_max_usdc_exposure": body.max_usdc_exposure,
-        "reinvest_profit_pct": body.reinvest_profit_pct,
-        "today": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-        "last_tick_ts": None
-    })
-    sumfile["base_exposure_usdc"] = float(body.max_usdc_exposure)
-    sumfile["reinvest_profit_pct"] = float(body.reinvest_profit_pct)
-    sumfile["effective_max_usdc_exposure"] = _effective_exposure(body.max_usdc_exposure)
-    _write_json(F_SUM, sumfile)
+        sumfile = _read_json(pf.f_sum, {
+            "open_count": 0, "closed_count": 0,
+            "realized_pnl_usdc_total": 0.0, "realized_pnl_usdc_today": 0.0,
+            "win_rate": 0.0, "avg_pnl_usdc": 0.0,
+            "max_drawdown_usdc": 0.0,
+            "base_exposure_usdc": body.max_usdc_exposure,
+            "adjustment_usdc": 0.0,
+            "effective_max_usdc_exposure": body.max_usdc_exposure,
+            "reinvest_profit_pct": body.reinvest_profit_pct,
+            "today": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            "last_tick_ts": None
+        })
+        sumfile["base_exposure_usdc"] = float(body.max_usdc_exposure)
+        sumfile["reinvest_profit_pct"] = float(body.reinvest_profit_pct)
+        sumfile["effective_max_usdc_exposure"] = _effective_exposure(pf, body.max_usdc_exposure)
+        # новый дневной лимит действует сразу, а не со следующего тика
+        open_list = _read_json(pf.f_open, [])
+        pr = risk_engine.sync(pf, open_list, sumfile, out, cache_marks(open_list))
+        sumfile["kill_switch"] = pr.kill_record()
+        _write_json(pf.f_sum, sumfile)
 
     out["effective_max_usdc_exposure"] = sumfile["effective_max_usdc_exposure"]
+    bus.publish("settings", {"portfolio": pf.id, "settings": out}, key=f"settings:{pf.id}")
     return out
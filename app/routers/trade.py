@@ -1,49 +1,96 @@
 from fastapi import APIRouter, HTTPException, Depends
-from app.models import PreviewRequest, PreviewResponse, MarketOrderRequest, Settings
+from app.models import PreviewRequest, PreviewResponse, BatchPreviewRequest, BatchPreviewResponse, MarketOrderRequest, Settings
 from app.utils.storage import load_settings
 from app.utils.auth import require_bearer
-from app.config import config
+from app.services.execution import get_engine, live_allowed, ExchangeError, OrderError
+from app.services.prices import price_cache
+from app.services.portfolios import Portfolio, portfolio_dep
+from app.services.risk import risk_engine, risk_sized_notional
 
 router = APIRouter()
+scoped = APIRouter(prefix="/portfolios/{pid}")
 
-# Простейший расчёт размера позиции (MVP, paper-логика)
-@router.post("/trade/preview", response_model=PreviewResponse)
-def trade_preview(req: PreviewRequest):
-    s: Settings = load_settings()
-    # оценка цены: если не задана — считаем как 1.0 для примера (в проде получить реальную цену из /ticker)
-    price = req.price or 1.0
-    # ограничение позиции
-    qty_by_pos = s.max_position_size_usdc / max(price, 1e-8)
+def _settings(pf: Portfolio) -> Settings:
+    # те же настройки, что пишет PUT /settings этого портфеля, с кэшем по mtime файла
+    return load_settings(pf.f_set)
+
+def _preview(req: PreviewRequest, s: Settings) -> PreviewResponse:
+    symbol = req.symbol.upper()
+    # цена: из запроса, иначе из общего кэша (ask для BUY, bid для SELL) — без запросов к бирже
+    price = req.price or price_cache.price(symbol, req.side)
+    if not price:
+        return PreviewResponse(symbol=symbol, side=req.side, qty=0.0, est_cost_usdc=0.0,
+                               notes="no cached price for symbol")
+    # размер: risk_per_trade_pct от экспозиции на дистанцию стопа, но не больше лимита позиции
+    notional = risk_sized_notional(s.max_usdc_exposure, s.risk_per_trade_pct, req.stop_distance_pct, s.max_position_size_usdc)
+    qty_by_pos = notional / max(price, 1e-8)
     # экспозиция — здесь упростим, рассчитываем только текущую сделку
     est_cost = qty_by_pos * price
     stop_price = price * (1 - req.stop_distance_pct / 100) if req.side == "BUY" else price * (1 + req.stop_distance_pct / 100)
     take_price = price * (1 + req.take_profit_pct / 100) if req.side == "BUY" else price * (1 - req.take_profit_pct / 100)
     return PreviewResponse(
-        symbol=req.symbol.upper(),
+        symbol=symbol,
         side=req.side,
         qty=round(qty_by_pos, 8),
         est_cost_usdc=round(est_cost, 2),
         stop_price=round(stop_price, 8),
         take_profit_price=round(take_price, 8),
-        notes="MVP preview without live price feed"
+        notes="price from request" if req.price else "price from book ticker cache"
     )
 
+# Простейший расчёт размера позиции (MVP, paper-логика)
+@router.post("/trade/preview", response_model=PreviewResponse)
+@scoped.post("/trade/preview", response_model=PreviewResponse)
+async def trade_preview(req: PreviewRequest, pf: Portfolio = Depends(portfolio_dep)):
+    if not req.price:
+        await price_cache.ensure_fresh()
+    return _preview(req, _settings(pf))
+
+# Пакетный расчёт: весь watchlist одним запросом по кэшу цен и настроек
+@router.post("/trade/preview/batch", response_model=BatchPreviewResponse)
+@scoped.post("/trade/preview/batch", response_model=BatchPreviewResponse)
+async def trade_preview_batch(req: BatchPreviewRequest, pf: Portfolio = Depends(portfolio_dep)):
+    if any(not x.price for x in req.items):
+        await price_cache.ensure_fresh()
+    s = _settings(pf)
+    return BatchPreviewResponse(items=[_preview(x, s) for x in req.items], prices_age_sec=price_cache.age_sec())
+
 @router.post("/trade/market")
-def trade_market(req: MarketOrderRequest, _: bool = Depends(require_bearer)):
-    s: Settings = load_settings()
-    if config.trade_mode != "paper" or config.live_enabled:
-        # TODO: здесь разместить реальный ордер на Binance (SIGNED /api/v3/order)
-        pass
+@scoped.post("/trade/market")
+async def trade_market(req: MarketOrderRequest, pf: Portfolio = Depends(portfolio_dep),
+                       _: bool = Depends(require_bearer)):
+    s: Settings = _settings(pf)
+    return_to_usdc = req.return_to_usdc_on_close if req.return_to_usdc_on_close is not None else s.return_to_usdc
+    kill = risk_engine.kill_state(pf) if req.side == "BUY" else None
+    if kill:
+        raise HTTPException(status_code=409, detail=f"kill switch: {kill.get('reason')}")
+    if live_allowed():
+        # SIGNED /api/v3/order; без qty покупаем на max_position_size_usdc через quoteOrderQty
+        try:
+            engine = await get_engine(s.allowed_symbols)
+            if req.qty is not None:
+                res = await engine.market_order(req.symbol, req.side, qty=req.qty,
+                                                price_hint=price_cache.price(req.symbol.upper(), req.side))
+            else:
+                res = await engine.market_order(req.symbol, req.side, quote_qty=s.max_position_size_usdc)
+        except ExchangeError as e:
+            raise HTTPException(status_code=400 if e.status < 500 else 502, detail=str(e))
+        except OrderError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"paper": False, **res, "return_to_usdc_on_close": return_to_usdc}
     # В режиме paper — просто возвращаем симулированный ответ
     qty = req.qty
     if qty is None:
-        price = 1.0  # TODO: получить реальную цену
-        qty = s.max_position_size_usdc / max(price, 1e-8)
+        await price_cache.ensure_fresh()
+        price = price_cache.price(req.symbol.upper(), req.side)
+        if not price:
+            raise HTTPException(status_code=503, detail=f"no price for {req.symbol.upper()}")
+        qty = s.max_position_size_usdc / price
     return {
         "paper": True,
         "symbol": req.symbol.upper(),
         "side": req.side,
         "qty": round(qty, 8),
-        "return_to_usdc_on_close": req.return_to_usdc_on_close if req.return_to_usdc_on_close is not None else s.return_to_usdc,
+        "return_to_usdc_on_close": return_to_usdc,
         "message": "Order simulated (paper mode). For LIVE set LIVE_ENABLED=true and TRADE_MODE=live."
     }
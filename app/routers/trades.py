@@ -1,22 +1,21 @@
 from __future__ import annotations
-from fastapi import APIRouter, Header, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 from pydantic import BaseModel
 from pathlib import Path
 import json, time, os
 from datetime import datetime, timezone
+from app.services.portfolios import DB, Portfolio, portfolio_dep, portfolio_lock
+from app.utils.storage import write_json_atomic
+from app.services import history
+from app.services.events import bus
+from app.services.risk import risk_engine, cache_marks
 
 router = APIRouter(prefix="/trades", tags=["trades"])
+scoped = APIRouter(prefix="/portfolios/{pid}/trades", tags=["trades"])
 
 # ---- storage helpers
-ROOT = Path(__file__).resolve().parents[1]  # .../app
-DB = ROOT / "db"
 DB.mkdir(exist_ok=True)
 
-F_OPEN   = DB / "trades_open.json"
-F_CLOSED = DB / "trades_closed.json"
-F_SUM    = DB / "trades_summary.json"
-F_SET    = DB / "settings.json"
-
 def _read_json(p: Path, default):
     if not p.exists():
         return default
@@ -27,8 +26,7 @@ def _read_json(p: Path, default):
         return default
 
 def _write_json(p: Path, data):
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(p, data, indent=2)
 
 def _now_iso():
     return datetime.now(timezone.utc).isoformat()
@@ -61,16 +59,16 @@ class PostClose(BaseModel):
     exit_price: float
 
 # ---- helpers for settings/exposure
-def _load_settings():
-    s = _read_json(F_SET, {})
+def _load_settings(pf: Portfolio):
+    s = _read_json(pf.f_set, {})
     # sane defaults
     s.setdefault("max_usdc_exposure", 100.0)
     s.setdefault("reinvest_profit_pct", 0.0)
     s.setdefault("auto_adjust_exposure", True)
     return s
 
-def _load_summary_default():
-    s = _load_settings()
+def _load_summary_default(pf: Portfolio):
+    s = _load_settings(pf)
     return {
         "open_count": 0,
         "closed_count": 0,
@@ -86,138 +84,173 @@ def _load_summary_default():
         "today": _today_str(),
     }
 
-def _recalc_summary(open_list, closed_list):
-    s = _read_json(F_SUM, _load_summary_default())
+def _recalc_summary(pf: Portfolio, open_list, meta=None, save=True):
+    s = _read_json(pf.f_sum, _load_summary_default(pf))
     # базовые из настроек (могли измениться)
-    sets = _load_settings()
+    sets = _load_settings(pf)
     s["base_exposure_usdc"] = sets["max_usdc_exposure"]
     s["reinvest_profit_pct"] = sets["reinvest_profit_pct"]
 
     s["open_count"] = len(open_list)
-    s["closed_count"] = len(closed_list)
-
-    total = sum(x.get("pnl_usdc", 0.0) for x in closed_list)
-    s["realized_pnl_usdc_total"] = round(total, 6)
-
-    today = _today_str()
-    s["realized_pnl_usdc_today"] = round(
-        sum(x.get("pnl_usdc", 0.0) for x in closed_list if x.get("exit_time","")[:10] == today), 6
-    )
-
-    wins = sum(1 for x in closed_list if x.get("pnl_usdc", 0.0) > 0)
-    s["win_rate"] = round(100.0 * wins / max(1, len(closed_list)), 2)
-
-    s["avg_pnl_usdc"] = round(total / max(1, len(closed_list)), 6)
-
-    # max drawdown: упрощённо — минимальная накопленная кумулятивная доходность
-    cum, min_cum = 0.0, 0.0
-    for x in closed_list:
-        cum += x.get("pnl_usdc", 0.0)
-        min_cum = min(min_cum, cum)
-    s["max_drawdown_usdc"] = round(-min_cum, 6)
+    # закрытые — из готовых роллапов истории, без прохода по всем сделкам
+    s.update(history.summary_fields(meta or history.load_meta(pf)))
 
     s["effective_max_usdc_exposure"] = round(s["base_exposure_usdc"] + s["adjustment_usdc"], 6)
 
-    _write_json(F_SUM, s)
+    if save:
+        _write_json(pf.f_sum, s)
     return s
 
+def _sync_risk(pf: Portfolio, open_list, summary):
+    # ручные открытия/закрытия сразу попадают в поток оценки риска; пробой лимита фиксируется в сводке
+    pr = risk_engine.sync(pf, open_list, summary, _read_json(pf.f_set, {}), cache_marks(open_list))
+    if summary.get("kill_switch") != pr.kill_record():
+        summary["kill_switch"] = pr.kill_record()
+        _write_json(pf.f_sum, summary)
+
 # ---- GET endpoints
 @router.get("/open")
-def get_open_trades(authorization: str | None = Header(default=None)):
+@scoped.get("/open")
+def get_open_trades(pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    return _read_json(F_OPEN, [])
+    return _read_json(pf.f_open, [])
 
 @router.get("/closed")
-def get_closed_trades(limit: int = 200, authorization: str | None = Header(default=None)):
+@scoped.get("/closed")
+def get_closed_trades(limit: int = 200, pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    arr = _read_json(F_CLOSED, [])
-    return arr[-limit:]
+    return history.load_closed(pf, limit)
 
 @router.get("/summary")
-def get_summary(authorization: str | None = Header(default=None)):
+@scoped.get("/summary")
+def get_summary(pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    open_list = _read_json(F_OPEN, [])
-    closed_list = _read_json(F_CLOSED, [])
-    return _recalc_summary(open_list, closed_list)
+    # только чтение: файл сводки пишут тик и изменяющие эндпоинты под блокировкой портфеля
+    return _recalc_summary(pf, _read_json(pf.f_open, []), save=False)
 
 # ---- POST open/close
 @router.post("/open")
-def post_open(body: PostOpen, authorization: str | None = Header(default=None)):
+@scoped.post("/open")
+def post_open(body: PostOpen, pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    open_list = _read_json(F_OPEN, [])
-    # forbid duplicate IDs
-    if any(x["id"] == body.id for x in open_list):
-        raise HTTPException(400, detail="id already open")
-    now = _now_iso()
-    row = {
-        "id": body.id,
-        "symbol": body.symbol.upper(),
-        "side": body.side.upper(),
-        "qty": float(body.qty),
-        "entry_price": float(body.entry_price),
-        "notional_usdc": float(body.notional_usdc),
-        "entry_time": now
-    }
-    open_list.append(row)
-    _write_json(F_OPEN, open_list)
-    # update summary counters (open_count)
-    _recalc_summary(open_list, _read_json(F_CLOSED, []))
+    with portfolio_lock(pf):
+        open_list = _read_json(pf.f_open, [])
+        # forbid duplicate IDs
+        if any(x["id"] == body.id for x in open_list):
+            raise HTTPException(400, detail="id already open")
+        now = _now_iso()
+        row = {
+            "id": body.id,
+            "symbol": body.symbol.upper(),
+            "side": body.side.upper(),
+            "qty": float(body.qty),
+            "entry_price": float(body.entry_price),
+            "notional_usdc": float(body.notional_usdc),
+            "entry_time": now
+        }
+        open_list.append(row)
+        _write_json(pf.f_open, open_list)
+        # update summary counters (open_count)
+        summary = _recalc_summary(pf, open_list)
+        _sync_risk(pf, open_list, summary)
+    bus.publish("position.open", {"portfolio": pf.id, "trade": row})
+    bus.publish_summary(pf.id, summary)
     return row
 
 @router.post("/close")
-def post_close(body: PostClose, authorization: str | None = Header(default=None)):
+@scoped.post("/close")
+def post_close(body: PostClose, pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    open_list = _read_json(F_OPEN, [])
-    idx = next((i for i,x in enumerate(open_list) if x["id"] == body.id), None)
-    if idx is None:
-        raise HTTPException(404, detail="id not found")
-    row = open_list.pop(idx)
-    exit_time = _now_iso()
-    side = row["side"]
-    qty = float(row["qty"])
-    entry = float(row["entry_price"])
-    exitp = float(body.exit_price)
-
-    # pnl BUY = q*(exit-entry); SELL = q*(entry-exit)
-    pnl = qty * (exitp - entry) if side == "BUY" else qty * (entry - exitp)
-    pnl_pct = 0.0
-    if row["notional_usdc"] > 0:
-        pnl_pct = 100.0 * pnl / float(row["notional_usdc"])
-
-    closed_row = {
-        **row,
-        "exit_price": exitp,
-        "pnl_usdc": round(pnl, 6),
-        "pnl_pct": round(pnl_pct, 4),
-        "exit_time": exit_time,
-        "duration_sec": round(
-            max(0.0, datetime.fromisoformat(exit_time).timestamp() - datetime.fromisoformat(row["entry_time"]).timestamp()), 3
-        )
-    }
-    closed_list = _read_json(F_CLOSED, [])
-    closed_list.append(closed_row)
-    _write_json(F_OPEN, open_list)
-    _write_json(F_CLOSED, closed_list)
-
-    # adjust exposure if enabled
-    summary = _read_json(F_SUM, _load_summary_default())
-    sets = _load_settings()
-    if sets.get("auto_adjust_exposure", True):
-        if pnl >= 0:
-            k = float(sets.get("reinvest_profit_pct", 0.0)) / 100.0
-            summary["adjustment_usdc"] = round(float(summary.get("adjustment_usdc", 0.0)) + pnl * k, 6)
-        else:
-            summary["adjustment_usdc"] = round(float(summary.get("adjustment_usdc", 0.0)) + pnl, 6)  # pnl < 0
-
-    _write_json(F_SUM, summary)
-    _recalc_summary(open_list, closed_list)
+    with portfolio_lock(pf):
+        open_list = _read_json(pf.f_open, [])
+        idx = next((i for i,x in enumerate(open_list) if x["id"] == body.id), None)
+        if idx is None:
+            raise HTTPException(404, detail="id not found")
+        row = open_list.pop(idx)
+        exit_time = _now_iso()
+        side = row["side"]
+        qty = float(row["qty"])
+        entry = float(row["entry_price"])
+        exitp = float(body.exit_price)
+
+        # pnl BUY = q*(exit-entry); SELL = q*(entry-exit)
+        pnl = qty * (exitp - entry) if side == "BUY" else qty * (entry - exitp)
+        pnl_pct = 0.0
+        if row["notional_usdc"] > 0:
+            pnl_pct = 100.0 * pnl / float(row["notional_usdc"])
+
+        closed_row = {
+            **row,
+            "exit_price": exitp,
+            "pnl_usdc": round(pnl, 6),
+            "pnl_pct": round(pnl_pct, 4),
+            "exit_time": exit_time,
+            "duration_sec": round(
+                max(0.0, datetime.fromisoformat(exit_time).timestamp() - datetime.fromisoformat(row["entry_time"]).timestamp()), 3
+            )
+        }
+        _write_json(pf.f_open, open_list)
+        meta = history.record_closed(pf, [closed_row])
+
+        # adjust exposure if enabled
+        summary = _read_json(pf.f_sum, _load_summary_default(pf))
+        sets = _load_settings(pf)
+        if sets.get("auto_adjust_exposure", True):
+            if pnl >= 0:
+                k = float(sets.get("reinvest_profit_pct", 0.0)) / 100.0
+                summary["adjustment_usdc"] = round(float(summary.get("adjustment_usdc", 0.0)) + pnl * k, 6)
+            else:
+                summary["adjustment_usdc"] = round(float(summary.get("adjustment_usdc", 0.0)) + pnl, 6)  # pnl < 0
+
+        _write_json(pf.f_sum, summary)
+        summary = _recalc_summary(pf, open_list, meta)
+        _sync_risk(pf, open_list, summary)
+    bus.publish("position.close", {"portfolio": pf.id, "trade": closed_row})
+    bus.publish_summary(pf.id, summary)
     return closed_row
 
 # ---- RESET everything
 @router.post("/reset")
-def post_reset(authorization: str | None = Header(default=None)):
+@scoped.post("/reset")
+def post_reset(pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
     if not _auth_ok(authorization): raise HTTPException(401)
-    _write_json(F_OPEN, [])
-    _write_json(F_CLOSED, [])
-    _write_json(F_SUM, _load_summary_default())
+    with portfolio_lock(pf):
+        _write_json(pf.f_open, [])
+        history.reset(pf)
+        summary = _load_summary_default(pf)
+        _write_json(pf.f_sum, summary)
+        risk_engine.reset(pf.id)
+    bus.publish_summary(pf.id, summary)
     return {"ok": True, "note": "trades cleared"}
+
+# ---- риск в реальном времени
+@router.get("/risk")
+@scoped.get("/risk")
+def get_risk(pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
+    if not _auth_ok(authorization): raise HTTPException(401)
+    with portfolio_lock(pf):
+        open_list = _read_json(pf.f_open, [])
+        _sync_risk(pf, open_list, _read_json(pf.f_sum, _load_summary_default(pf)))
+    return risk_engine.status(pf.id)
+
+# ---- analytics (из роллапов истории)
+@router.get("/analytics/equity")
+@scoped.get("/analytics/equity")
+def get_equity_curve(start: str | None = None, end: str | None = None,
+                     pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
+    if not _auth_ok(authorization): raise HTTPException(401)
+    return history.equity_curve(history.load_meta(pf), start, end)
+
+@router.get("/analytics/symbols")
+@scoped.get("/analytics/symbols")
+def get_symbol_breakdown(pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
+    if not _auth_ok(authorization): raise HTTPException(401)
+    return history.by_symbol(history.load_meta(pf))
+
+@router.get("/analytics/range")
+@scoped.get("/analytics/range")
+def get_range_stats(start: str | None = None, end: str | None = None,
+                    pf: Portfolio = Depends(portfolio_dep), authorization: str | None = Header(default=None)):
+    """Статистика за период по дневным роллапам; start/end — YYYY-MM-DD включительно."""
+    if not _auth_ok(authorization): raise HTTPException(401)
+    return history.range_stats(history.load_meta(pf), start, end)
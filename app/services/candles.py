@@ -0,0 +1,199 @@
+# app/services/candles.py
+from __future__ import annotations
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List
+import httpx
+
+# Один поток 1m-свечей на символ; старшие таймфреймы собираются локально и инкрементально.
+
+KLINES_URL = "https://api.binance.com/api/v3/klines"
+MINUTE_MS = 60_000
+TF_MIN = {
+    "1m": 1, "3m": 3, "5m": 5, "15m": 15, "30m": 30,
+    "1h": 60, "2h": 120, "4h": 240, "6h": 360, "8h": 480, "12h": 720,
+    "1d": 1440, "1w": 10080,
+}
+DEFAULT_TFS = ("1m", "5m", "15m", "1h")   # ведутся всегда — переключение без догрузки
+WEEK_OFFSET_MS = 4 * 86_400_000           # эпоха — четверг, недели Binance начинаются с понедельника
+KEEP_1M = 1500                            # ~сутки минуток в памяти
+KEEP_BARS = 500                           # баров на старший таймфрейм
+MAX_LIMIT = 1000                          # лимит /api/v3/klines
+
+
+def tf_ms(tf: str) -> int:
+    return TF_MIN[tf] * MINUTE_MS
+
+def bucket_start(open_ms: int, tf: str) -> int:
+    off = WEEK_OFFSET_MS if tf == "1w" else 0
+    return open_ms - (open_ms - off) % tf_ms(tf)
+
+
+class Bar:
+    __slots__ = ("t", "o", "h", "l", "c", "v", "closed")
+
+    def __init__(self, t: int, o: float, h: float, l: float, c: float, v: float, closed: bool = False):
+        self.t, self.o, self.h, self.l, self.c, self.v, self.closed = t, o, h, l, c, v, closed
+
+    def as_list(self) -> list:
+        return [self.t, self.o, self.h, self.l, self.c, self.v, self.closed]
+
+
+class Frame:
+    """Агрегатор одного таймфрейма поверх 1m-баров."""
+
+    def __init__(self, tf: str, keep: int = KEEP_BARS):
+        self.tf = tf
+        self.size = tf_ms(tf)
+        self.bars: Deque[Bar] = deque(maxlen=keep)
+
+    def apply(self, m: Bar, prev: Bar | None) -> None:
+        # prev — прежняя версия той же минуты (частичный бар обновился), её вклад заменяем
+        t = bucket_start(m.t, self.tf)
+        last = self.bars[-1] if self.bars else None
+        if last is None or t > last.t:
+            if last is not None:
+                last.closed = True   # пришла минута следующего бакета — предыдущий завершён
+            last = Bar(t, m.o, m.h, m.l, m.c, m.v)
+            self.bars.append(last)
+        elif t == last.t:
+            # h/l частичной минуты только расширяются, объём накопительный
+            last.h = max(last.h, m.h)
+            last.l = min(last.l, m.l)
+            last.c = m.c
+            last.v += m.v - (prev.v if prev is not None else 0.0)
+        else:
+            return   # минута из уже ушедшего бакета — игнорируем
+        if m.closed and m.t + MINUTE_MS >= t + self.size:
+            last.closed = True
+
+    def seal(self, now_ms: int) -> None:
+        if self.bars and self.bars[-1].t + self.size <= now_ms:
+            self.bars[-1].closed = True
+
+    def seed(self, rows: Iterable[list], now_ms: int) -> None:
+        # нативные закрытые бары биржи — только до первого локально собранного бакета
+        rows = list(rows)
+        cut = self.bars[0].t if self.bars else None
+        older = [Bar(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]), True)
+                 for r in rows if int(r[6]) < now_ms and (cut is None or int(r[0]) < cut)]
+        if cut is None and rows and int(rows[-1][6]) >= now_ms:
+            # минутки не достают до начала текущего бакета (1d/1w): берём открытый бар биржи как частичный,
+            # дальше apply() дополняет его новыми минутами (текущая минута уже учтена — заменяется по дельте)
+            r = rows[-1]
+            self.bars.append(Bar(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5])))
+        for b in reversed(older):
+            if len(self.bars) == self.bars.maxlen:
+                break
+            self.bars.appendleft(b)
+
+
+class SymbolCandles:
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.m1: Deque[Bar] = deque(maxlen=KEEP_1M)
+        self.frames: Dict[str, Frame] = {}
+
+    def ingest(self, t: int, o: float, h: float, l: float, c: float, v: float, closed: bool) -> None:
+        m = Bar(t, o, h, l, c, v, closed)
+        prev = None
+        if self.m1:
+            last = self.m1[-1]
+            if t < last.t:
+                return
+            if t == last.t:
+                prev = last
+                self.m1[-1] = m
+            else:
+                last.closed = True
+                self.m1.append(m)
+        else:
+            self.m1.append(m)
+        for fr in self.frames.values():
+            fr.apply(m, prev)
+
+    def add_frame(self, tf: str) -> Frame:
+        fr = self.frames.get(tf)
+        if fr is not None:
+            return fr
+        fr = Frame(tf)
+        # собираем из уже накопленных минуток; неполный первый бакет пропускаем
+        started = False
+        for m in self.m1:
+            if not started:
+                if bucket_start(m.t, tf) != m.t:
+                    continue
+                started = True
+            fr.apply(m, None)
+        self.frames[tf] = fr
+        return fr
+
+    def last_open_ms(self) -> int | None:
+        return self.m1[-1].t if self.m1 else None
+
+    def bars(self, tf: str, include_partial: bool = True) -> List[Bar]:
+        src = self.m1 if tf == "1m" else self.frames[tf].bars
+        out = list(src)
+        if not include_partial and out and not out[-1].closed:
+            out.pop()
+        return out
+
+    def closes(self, tf: str, include_partial: bool = True) -> List[float]:
+        return [b.c for b in self.bars(tf, include_partial)]
+
+
+class CandleFeed:
+    """Хранилище свечей по символам + инкрементальная подкачка 1m с биржи."""
+
+    def __init__(self):
+        self.symbols: Dict[str, SymbolCandles] = {}
+        self._http: httpx.AsyncClient | None = None
+        self.requests = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=10.0)
+        return self._http
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _klines(self, symbol: str, tf: str, limit: int) -> list:
+        self.requests += 1
+        r = await self._client().get(KLINES_URL, params={"symbol": symbol, "interval": tf, "limit": limit})
+        r.raise_for_status()
+        return r.json()
+
+    async def sync(self, symbol: str, tfs: Iterable[str] = (), min_bars: int = 80) -> SymbolCandles:
+        """Дотягивает новые минутки (один запрос) и гарантирует нужные таймфреймы."""
+        sc = self.symbols.get(symbol)
+        now_ms = int(time.time() * 1000)
+        last = sc.last_open_ms() if sc else None
+        if sc is None or last is None or now_ms - last > (MAX_LIMIT - 1) * MINUTE_MS:
+            sc = SymbolCandles(symbol)
+            self.symbols[symbol] = sc
+            limit = MAX_LIMIT
+        else:
+            # текущая минута + всё, что появилось после последней известной
+            limit = max(2, (now_ms - last) // MINUTE_MS + 1)
+        for r in await self._klines(symbol, "1m", int(limit)):
+            sc.ingest(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]), int(r[6]) < now_ms)
+
+        for tf in {*DEFAULT_TFS, *(t for t in tfs if t in TF_MIN)} - {"1m"}:
+            new = tf not in sc.frames
+            fr = sc.add_frame(tf)
+            if new and len(fr.bars) < min_bars:
+                # разовая догрузка истории, которую минутки не покрывают
+                fr.seed(await self._klines(symbol, tf, min(min_bars + 1, MAX_LIMIT)), now_ms)
+            fr.seal(now_ms)
+        return sc
+
+    async def closes(self, symbol: str, tf: str, min_bars: int = 80) -> List[float]:
+        tf = tf if tf in TF_MIN else "1m"
+        sc = await self.sync(symbol, (tf,), min_bars)
+        return sc.closes(tf)[-min_bars:]
+
+
+candle_feed = CandleFeed()
@@ -0,0 +1,277 @@
+# app/services/events.py
+from __future__ import annotations
+import asyncio, json, os, sqlite3, threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Tuple
+
+from app.services.portfolios import DB
+
+# Шина событий для push-канала (/events, SSE): тики, открытия/закрытия позиций, дельты сводки, настройки.
+# Публиковать можно из любого потока (sync-эндпоинты FastAPI живут в threadpool).
+# При нескольких воркерах события идут через общую ленту в SQLite (EventRelay): любой воркер дописывает,
+# каждый читает хвост в свою локальную шину — id события одинаковый везде, Last-Event-ID работает на любом.
+# Запись в ленту — фоновой задачей через поток: publish не блокирует event loop на SQLite.
+
+HISTORY_SIZE = 1000     # кольцевой буфер для возобновления по Last-Event-ID
+QUEUE_SIZE = 200        # очередь на подписчика
+RELAY_DB = Path(os.getenv("LEADER_DB", str(DB / "leader.sqlite")))
+RELAY_POLL_SEC = 0.25
+RELAY_KEEP = 10 * HISTORY_SIZE
+RELAY_BATCH = 500
+
+
+class Event:
+    __slots__ = ("id", "type", "data", "key")
+
+    def __init__(self, id: int, type: str, data: Dict[str, Any], key: str | None = None):
+        self.id, self.type, self.data, self.key = id, type, data, key
+
+    def sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, ensure_ascii=False)}\n\n"
+
+
+class Subscriber:
+    """Ограниченная очередь: события с ключом схлопываются, при переполнении старые выбрасываются."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, portfolio: str | None, size: int = QUEUE_SIZE):
+        self.loop = loop
+        self.portfolio = portfolio
+        self.size = size
+        self.pending: "OrderedDict[Any, Event]" = OrderedDict()
+        self.dropped = 0
+        self._wake = asyncio.Event()
+
+    def wants(self, ev: Event) -> bool:
+        pid = ev.data.get("portfolio")
+        return self.portfolio is None or pid is None or pid == self.portfolio
+
+    def push(self, ev: Event) -> None:
+        # вызывается только в потоке цикла подписчика
+        if ev.key is not None and ev.key in self.pending:
+            old = self.pending.pop(ev.key)
+            if ev.type == "summary":
+                # дельты сводки сливаются: поля новой поверх старой
+                ev = Event(ev.id, ev.type, {**old.data, **ev.data}, ev.key)
+        while len(self.pending) >= self.size:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[ev.key if ev.key is not None else ("#", ev.id)] = ev
+        self._wake.set()
+
+    async def get(self, timeout: float) -> List[Event]:
+        if not self.pending:
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        out = sorted(self.pending.values(), key=lambda e: e.id)
+        self.pending.clear()
+        return out
+
+
+class EventRelay:
+    """Общая лента событий между воркерами: таблица events в SQLite (тот же файл, что и аренда лидера)."""
+
+    def __init__(self, path: Path = RELAY_DB, keep: int = RELAY_KEEP):
+        self.path = path
+        self.keep = keep
+        self._local = threading.local()
+        self._appended = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # соединение на поток: публикуют и loop, и threadpool
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            # WAL: читатели ленты не ждут писателей, а запись события не ждёт чтения аренды
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "type TEXT NOT NULL, data TEXT NOT NULL, key TEXT)"
+            )
+            self._local.con = con
+        return con
+
+    def append_many(self, rows: List[Tuple[str, str, str | None]]) -> int:
+        """Дописать пачку (type, data-json, key) одной транзакцией; возвращает id последнего."""
+        con = self._conn()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            last = 0
+            for row in rows:
+                last = con.execute("INSERT INTO events (type, data, key) VALUES (?, ?, ?)", row).lastrowid
+            before, self._appended = self._appended, self._appended + len(rows)
+            if self._appended // 200 != before // 200:
+                con.execute("DELETE FROM events WHERE id <= ?", (last - self.keep,))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return last
+
+    def since(self, last_id: int, limit: int = RELAY_BATCH) -> List[Tuple[int, str, str, str | None]]:
+        return self._conn().execute(
+            "SELECT id, type, data, key FROM events WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit)
+        ).fetchall()
+
+    def max_id(self) -> int:
+        row = self._conn().execute("SELECT MAX(id) FROM events").fetchone()
+        return int(row[0] or 0)
+
+
+class EventBus:
+    def __init__(self, history: int = HISTORY_SIZE):
+        self._seq = 0
+        self._buf: Deque[Event] = deque(maxlen=history)
+        self._subs: List[Subscriber] = []
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.relay: EventRelay | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._outbox: Deque[Tuple[str, str, str | None]] = deque()   # ещё не записанное в ленту
+        self._pending: asyncio.Event | None = None
+        self._writer: asyncio.Task | None = None
+
+    @property
+    def last_id(self) -> int:
+        return self._seq
+
+    def publish(self, type: str, data: Dict[str, Any], key: str | None = None) -> None:
+        if self.relay is None:
+            # один процесс: доставляем сразу
+            with self._lock:
+                self._seq += 1
+                seq = self._seq
+            self._deliver(seq, type, data, key)
+            return
+        # сериализуем сразу (данные могут поменяться после публикации), пишет фоновая задача
+        self._outbox.append((type, json.dumps(data, ensure_ascii=False), key))
+        try:
+            self._loop.call_soon_threadsafe(self._pending.set)
+        except RuntimeError:
+            pass
+
+    def publish_summary(self, portfolio: str, summary: Dict[str, Any]) -> None:
+        # публикуется полная сводка; дельту считает доставка, одинаково во всех воркерах
+        self.publish("summary", {"portfolio": portfolio, **summary}, key=f"summary:{portfolio}")
+
+    def _deliver(self, id: int, type: str, data: Dict[str, Any], key: str | None) -> None:
+        with self._lock:
+            self._seq = max(self._seq, id)
+            if type == "summary":
+                # отправляем только изменившиеся поля сводки
+                pid = data.get("portfolio")
+                last = self._summaries.get(pid, {})
+                delta = {k: v for k, v in data.items() if k != "portfolio" and last.get(k) != v}
+                self._summaries[pid] = data
+                if not delta:
+                    return
+                data = {"portfolio": pid, **delta}
+            ev = Event(id, type, data, key)
+            self._buf.append(ev)
+            subs = list(self._subs)
+        for sub in subs:
+            if not sub.wants(ev):
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub.push, ev)
+            except RuntimeError:
+                pass  # цикл подписчика уже закрыт
+
+    async def start(self, relay: EventRelay | None = None) -> None:
+        """Включить ленту между воркерами; читаем только то, что появится после старта."""
+        self.relay = relay or EventRelay()
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._pending = asyncio.Event()
+        with self._lock:
+            self._seq = max(self._seq, await asyncio.to_thread(self.relay.max_id))
+        self._task = asyncio.create_task(self._tail())
+        self._writer = asyncio.create_task(self._write())
+
+    async def stop(self) -> None:
+        for t in (self._task, self._writer):
+            if t:
+                t.cancel()
+        self._task = self._writer = None
+        if self.relay is not None:
+            await self._flush()   # опубликованное до остановки не теряем
+        self.relay = None
+
+    async def _write(self) -> None:
+        while True:
+            await self._pending.wait()
+            self._pending.clear()
+            await self._flush()
+
+    async def _flush(self) -> None:
+        batch = []
+        while self._outbox:
+            batch.append(self._outbox.popleft())
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self.relay.append_many, batch)
+        except Exception:
+            # лента занята или недоступна — возвращаем пачку в начало очереди и повторяем позже
+            self._outbox.extendleft(reversed(batch))
+            await asyncio.sleep(RELAY_POLL_SEC)
+            self._pending.set()
+            return
+        self._wake.set()
+
+    async def _tail(self) -> None:
+        while True:
+            self._wake.clear()   # до чтения: публикация во время чтения разбудит следующий круг
+            try:
+                rows = await asyncio.to_thread(self.relay.since, self._seq)
+            except Exception:
+                rows = []
+            for id, type, data, key in rows:
+                self._deliver(id, type, json.loads(data), key)
+            if len(rows) < RELAY_BATCH:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), RELAY_POLL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def subscribe(self, portfolio: str | None = None,
+                        last_id: int | None = None) -> Tuple[Subscriber, List[Event], bool]:
+        """Подписка + события после last_id. Третье значение — нужна ли клиенту пересинхронизация.
+        Чего нет в кольцевом буфере (свежий/перезапущенный воркер), дочитываем из общей ленты."""
+        sub = Subscriber(asyncio.get_running_loop(), portfolio)
+        with self._lock:
+            self._subs.append(sub)
+            if last_id is None:
+                return sub, [], False
+            oldest = self._buf[0].id if self._buf else self._seq + 1
+            replay = [e for e in self._buf if e.id > last_id and sub.wants(e)]
+            seq = self._seq
+        if last_id > seq:
+            return sub, replay, True
+        if last_id >= oldest - 1:
+            return sub, replay, False
+        if self.relay is None:
+            return sub, replay, True
+        # всё, что новее буфера, подписчик уже получит из него или живьём; из ленты — только промежуток
+        try:
+            rows = await asyncio.to_thread(self.relay.since, last_id, oldest - 1 - last_id)
+        except Exception:
+            rows = []
+        if not rows or rows[0][0] != last_id + 1:
+            return sub, replay, True   # промежуток уже вычищен из ленты
+        older = [Event(id, type, json.loads(data), key) for id, type, data, key in rows if id < oldest]
+        return sub, [e for e in older if sub.wants(e)] + replay, False
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+
+bus = EventBus()
@@ -0,0 +1,200 @@
+# app/services/exchange_stub.py
+from __future__ import annotations
+import asyncio, hashlib, hmac, itertools, json, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+from urllib.parse import parse_qsl
+import httpx
+
+# Локальная заглушка Binance Spot: тот же HTTP-контракт, что у /api/v3, но в памяти процесса.
+# Подключается к BinanceClient через httpx.MockTransport, поэтому сеть не нужна.
+
+DEFAULT_PRICES = {"BTCUSDC": 60000.0, "ETHUSDC": 3000.0, "SOLUSDC": 150.0}
+
+def _sym_info(symbol: str, quote: str = "USDC", step: str = "0.00001", min_notional: str = "5") -> Dict[str, Any]:
+    return {
+        "symbol": symbol, "status": "TRADING", "baseAsset": symbol[: -len(quote)], "quoteAsset": quote,
+        "quoteAssetPrecision": 8, "isSpotTradingAllowed": True, "permissions": ["SPOT"],
+        "filters": [
+            {"filterType": "PRICE_FILTER", "minPrice": "0.01", "maxPrice": "1000000", "tickSize": "0.01"},
+            {"filterType": "LOT_SIZE", "minQty": step, "maxQty": "9000", "stepSize": step},
+            {"filterType": "NOTIONAL", "minNotional": min_notional},
+        ],
+    }
+
+
+class StubExchange:
+    def __init__(self, key: str = "stub-key", secret: str = "stub-secret",
+                 prices: Dict[str, float] | None = None, clock_skew_ms: int = 0,
+                 latency_sec: float = 0.0, fee_rate: float = 0.001, recv_window_max: int = 60000):
+        self.key = key
+        self.secret = secret.encode()
+        self.prices = dict(prices or DEFAULT_PRICES)
+        self.symbols = {s: _sym_info(s) for s in self.prices}
+        self.clock_skew_ms = clock_skew_ms      # биржевые часы относительно локальных
+        self.latency_sec = latency_sec
+        self.fee_rate = fee_rate
+        self.recv_window_max = recv_window_max
+        # ордер исполняется, но ответ теряется: "503" — 5xx с неизвестным статусом, "timeout" — обрыв по таймауту
+        self.drop_responses = 0
+        self.drop_mode = "503"
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.listen_keys: set[str] = set()
+        self.requests: List[str] = []
+        self._ids = itertools.count(1)
+        self._subs: List[Callable[[Dict[str, Any]], None]] = []
+
+    # ---- подключение
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self._handle)
+
+    def client(self):
+        from app.services.execution import BinanceClient
+        return BinanceClient(self.key, self.secret.decode(), "http://exchange-stub", transport=self.transport())
+
+    def subscribe(self, fn: Callable[[Dict[str, Any]], None]) -> None:
+        # вместо websocket user-data stream события отдаются подписчикам напрямую
+        self._subs.append(fn)
+
+    def set_price(self, symbol: str, price: float) -> None:
+        self.prices[symbol] = price
+        self.symbols.setdefault(symbol, _sym_info(symbol))
+
+    # ---- HTTP
+    def _now_ms(self) -> int:
+        return int(time.time() * 1000) + self.clock_skew_ms
+
+    @staticmethod
+    def _json(status: int, data: Any) -> httpx.Response:
+        return httpx.Response(status, json=data)
+
+    def _err(self, status: int, code: int, msg: str) -> httpx.Response:
+        return self._json(status, {"code": code, "msg": msg})
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+        path = request.url.path
+        raw_query = request.url.query.decode()
+        params = dict(parse_qsl(raw_query, keep_blank_values=True))
+        self.requests.append(f"{request.method} {path}")
+
+        if path == "/api/v3/time":
+            return self._json(200, {"serverTime": self._now_ms()})
+        if path == "/api/v3/exchangeInfo":
+            if "symbol" in params:
+                names = [params["symbol"]]
+            elif "symbols" in params:
+                names = json.loads(params["symbols"])
+            else:
+                names = list(self.symbols)
+            unknown = [n for n in names if n not in self.symbols]
+            if unknown:
+                return self._err(400, -1121, "Invalid symbol.")
+            return self._json(200, {"serverTime": self._now_ms(), "symbols": [self.symbols[n] for n in names]})
+        if path == "/api/v3/ticker/bookTicker":
+            def bt(s: str) -> Dict[str, str]:
+                p = self.prices[s]
+                return {"symbol": s, "bidPrice": f"{p * 0.9999:.8f}", "bidQty": "1",
+                        "askPrice": f"{p * 1.0001:.8f}", "askQty": "1"}
+            if "symbol" in params:
+                return self._json(200, bt(params["symbol"]))
+            return self._json(200, [bt(s) for s in self.prices])
+        if path == "/api/v3/userDataStream":
+            if request.headers.get("X-MBX-APIKEY") != self.key:
+                return self._err(401, -2015, "Invalid API-key, IP, or permissions for action.")
+            if request.method == "POST":
+                lk = f"lk{next(self._ids)}"
+                self.listen_keys.add(lk)
+                return self._json(200, {"listenKey": lk})
+            if request.method == "DELETE":
+                self.listen_keys.discard(params.get("listenKey"))
+            return self._json(200, {})
+        if path == "/api/v3/order":
+            err = self._check_signed(request, raw_query, params)
+            if err:
+                return err
+            if request.method == "POST":
+                resp = self._new_order(params)
+                if self.drop_responses > 0 and resp.status_code == 200:
+                    self.drop_responses -= 1
+                    if self.drop_mode == "timeout":
+                        raise httpx.ReadTimeout("stub: response lost", request=request)
+                    return self._err(503, -1007, "Timeout waiting for response from backend server. "
+                                                 "Send status unknown; execution status unknown.")
+                return resp
+            if request.method == "GET":
+                o = self.orders.get(params.get("origClientOrderId", ""))
+                return self._json(200, o) if o else self._err(400, -2013, "Order does not exist.")
+        if path == "/api/v3/myTrades":
+            err = self._check_signed(request, raw_query, params)
+            if err:
+                return err
+            oid = int(params.get("orderId", 0))
+            o = next((o for o in self.orders.values() if o["orderId"] == oid), None)
+            fills = o["fills"] if o else []
+            return self._json(200, [{"symbol": o["symbol"], "id": i, "orderId": oid, "isBuyer": o["side"] == "BUY",
+                                     "quoteQty": str(Decimal(f["qty"]) * Decimal(f["price"])), **f}
+                                    for i, f in enumerate(fills, 1)])
+        return self._err(404, -1000, f"stub: {request.method} {path} not implemented")
+
+    def _check_signed(self, request: httpx.Request, raw_query: str, params: Dict[str, str]) -> httpx.Response | None:
+        if request.headers.get("X-MBX-APIKEY") != self.key:
+            return self._err(401, -2015, "Invalid API-key, IP, or permissions for action.")
+        query, _, sig = raw_query.rpartition("&signature=")
+        good = hmac.new(self.secret, query.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(sig, good):
+            return self._err(400, -1022, "Signature for this request is not valid.")
+        ts = int(params.get("timestamp", 0))
+        rw = min(int(params.get("recvWindow", 5000)), self.recv_window_max)
+        now = self._now_ms()
+        if ts > now + 1000 or now - ts > rw:
+            return self._err(400, -1021, "Timestamp for this request is outside of the recvWindow.")
+        return None
+
+    def _new_order(self, p: Dict[str, str]) -> httpx.Response:
+        sym = p.get("symbol", "")
+        if sym not in self.symbols:
+            return self._err(400, -1121, "Invalid symbol.")
+        if p.get("type") != "MARKET":
+            return self._err(400, -1116, "Invalid orderType.")
+        info = self.symbols[sym]
+        lot = next(f for f in info["filters"] if f["filterType"] == "LOT_SIZE")
+        min_notional = Decimal(next(f for f in info["filters"] if f["filterType"] == "NOTIONAL")["minNotional"])
+        step, min_qty = Decimal(lot["stepSize"]), Decimal(lot["minQty"])
+        price = Decimal(str(self.prices[sym]))
+
+        if "quantity" in p:
+            qty = Decimal(p["quantity"])
+        elif "quoteOrderQty" in p:
+            qty = (Decimal(p["quoteOrderQty"]) / price // step) * step
+        else:
+            return self._err(400, -1102, "Mandatory parameter 'quantity' was not sent.")
+        if qty % step != 0 or qty < min_qty:
+            return self._err(400, -1013, "Filter failure: LOT_SIZE")
+        if qty * price < min_notional:
+            return self._err(400, -1013, "Filter failure: NOTIONAL")
+
+        oid = next(self._ids)
+        cid = p.get("newClientOrderId") or f"stub{oid}"
+        quote = qty * price
+        side = p.get("side", "BUY")
+        fee_asset = info["baseAsset"] if side == "BUY" else info["quoteAsset"]
+        fee = (qty if side == "BUY" else quote) * Decimal(str(self.fee_rate))
+        ts = self._now_ms()
+        order = {
+            "symbol": sym, "orderId": oid, "clientOrderId": cid, "transactTime": ts,
+            "price": "0", "origQty": str(qty), "executedQty": str(qty),
+            "cummulativeQuoteQty": str(quote), "status": "FILLED", "type": "MARKET", "side": side,
+            "fills": [{"price": str(price), "qty": str(qty), "commission": str(fee), "commissionAsset": fee_asset}],
+        }
+        self.orders[cid] = order
+        for st in ("NEW", "FILLED"):
+            ev = {
+                "e": "executionReport", "E": ts, "s": sym, "c": cid, "S": side, "o": "MARKET",
+                "X": st, "i": oid, "z": str(qty if st == "FILLED" else 0),
+                "Z": str(quote if st == "FILLED" else 0), "L": str(price),
+            }
+            for fn in self._subs:
+                fn(ev)
+        return self._json(200, order)
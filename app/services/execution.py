@@ -0,0 +1,428 @@
+# app/services/execution.py
+from __future__ import annotations
+import asyncio, hashlib, hmac, json, time, uuid
+from decimal import Decimal, ROUND_DOWN
+from typing import Any, Callable, Dict, List
+from urllib.parse import urlencode
+import httpx
+from app.config import config
+
+# websockets нужен только для user-data stream; без него статус ордеров берём из ответа/опроса
+try:
+    import websockets  # type: ignore
+except Exception:
+    websockets = None
+
+TIME_SYNC_SEC = 30.0          # пересинхронизация времени и заодно keep-alive соединения
+LISTEN_KEY_KEEPALIVE_SEC = 30 * 60
+FINAL_STATUSES = {"FILLED", "CANCELED", "REJECTED", "EXPIRED", "EXPIRED_IN_MATCH"}
+RECONCILE_WAIT_SEC = 2.0      # ждём executionReport, если ответ на POST /order потерян
+RECONCILE_ATTEMPTS = 3        # опросов GET /order до признания статуса неизвестным
+RECONCILE_DELAY_SEC = 0.5
+
+
+def live_allowed() -> bool:
+    # живые ордера — только при TRADE_MODE=live и LIVE_ENABLED=true одновременно
+    return config.trade_mode == "live" and config.live_enabled
+
+
+class OrderError(Exception):
+    """Ордер не может быть отправлен (локальная проверка фильтров, нет ключей и т.п.)."""
+
+
+class ExchangeError(OrderError):
+    def __init__(self, status: int, code: int | None, msg: str):
+        super().__init__(f"binance {status} [{code}]: {msg}")
+        self.status = status
+        self.code = code
+        self.msg = msg
+
+
+def _dec(x: Any) -> Decimal:
+    return Decimal(str(x or "0"))
+
+def _fmt(d: Decimal) -> str:
+    # без экспоненты и хвостовых нулей — так Binance принимает количество
+    s = format(d.normalize(), "f")
+    return s if s not in ("-0", "") else "0"
+
+
+class SymbolFilters:
+    """Фильтры символа из exchangeInfo: округляем количество локально, чтобы не ловить -1013."""
+    __slots__ = ("symbol", "base_asset", "step", "min_qty", "max_qty", "tick", "min_notional", "quote_precision")
+
+    def __init__(self, info: Dict[str, Any]):
+        self.symbol = info["symbol"]
+        self.base_asset = info.get("baseAsset", "")
+        self.quote_precision = int(info.get("quoteAssetPrecision", info.get("quotePrecision", 8)))
+        self.step = self.min_qty = self.max_qty = self.tick = self.min_notional = Decimal(0)
+        for f in info.get("filters", []):
+            t = f.get("filterType")
+            if t == "LOT_SIZE":
+                self.step = _dec(f.get("stepSize"))
+                self.min_qty = _dec(f.get("minQty"))
+                self.max_qty = _dec(f.get("maxQty"))
+            elif t == "PRICE_FILTER":
+                self.tick = _dec(f.get("tickSize"))
+            elif t in ("MIN_NOTIONAL", "NOTIONAL"):
+                self.min_notional = _dec(f.get("minNotional"))
+
+    def round_qty(self, qty: float | Decimal) -> Decimal:
+        d = _dec(qty)
+        if self.max_qty > 0 and d > self.max_qty:
+            d = self.max_qty
+        if self.step > 0:
+            d = (d / self.step).to_integral_value(rounding=ROUND_DOWN) * self.step
+        return d if d > 0 else Decimal(0)
+
+    def round_quote(self, amount: float | Decimal) -> Decimal:
+        q = Decimal(1).scaleb(-self.quote_precision)
+        return _dec(amount).quantize(q, rounding=ROUND_DOWN)
+
+    def check(self, qty: Decimal, price: float | None = None) -> str | None:
+        if qty <= 0 or qty < self.min_qty:
+            return f"{self.symbol}: qty {_fmt(qty)} below LOT_SIZE minQty {_fmt(self.min_qty)}"
+        if price and self.min_notional > 0 and qty * _dec(price) < self.min_notional:
+            return f"{self.symbol}: notional below {_fmt(self.min_notional)}"
+        return None
+
+
+class BinanceClient:
+    """Подписанные запросы к Binance Spot поверх одного прогретого пула соединений."""
+
+    def __init__(self, key: str | None, secret: str | None, base_url: str,
+                 recv_window: int = 5000, transport: httpx.AsyncBaseTransport | None = None):
+        self._secret = (secret or "").encode()
+        self.recv_window = recv_window
+        self.time_offset_ms = 0
+        self._synced_at = 0.0
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"X-MBX-APIKEY": key or ""},
+            timeout=httpx.Timeout(5.0, connect=3.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=90.0),
+            transport=transport,
+        )
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+    def _ts(self) -> int:
+        return int(time.time() * 1000) + self.time_offset_ms
+
+    def _sign(self, params: Dict[str, Any]) -> str:
+        query = urlencode(params)
+        sig = hmac.new(self._secret, query.encode(), hashlib.sha256).hexdigest()
+        return f"{query}&signature={sig}"
+
+    async def _request(self, method: str, url: str) -> Any:
+        r = await self._http.request(method, url)
+        if r.status_code >= 400:
+            try:
+                body = r.json()
+            except Exception:
+                body = {"msg": r.text}
+            raise ExchangeError(r.status_code, body.get("code"), body.get("msg", ""))
+        return r.json()
+
+    async def sync_time(self) -> int:
+        t0 = time.time()
+        data = await self._request("GET", "/api/v3/time")
+        t1 = time.time()
+        # серверное время сравниваем с серединой RTT
+        self.time_offset_ms = int(data["serverTime"] - (t0 + t1) * 500)
+        self._synced_at = t1
+        return self.time_offset_ms
+
+    async def public(self, method: str, path: str, params: Dict[str, Any] | None = None) -> Any:
+        url = f"{path}?{urlencode(params)}" if params else path
+        return await self._request(method, url)
+
+    async def keyed(self, method: str, path: str, params: Dict[str, Any] | None = None) -> Any:
+        # USER_STREAM: только API-ключ в заголовке, без подписи
+        return await self.public(method, path, params)
+
+    async def signed(self, method: str, path: str, params: Dict[str, Any]) -> Any:
+        if time.time() - self._synced_at > TIME_SYNC_SEC:
+            await self.sync_time()
+        for attempt in (0, 1):
+            q = self._sign({**params, "recvWindow": self.recv_window, "timestamp": self._ts()})
+            try:
+                return await self._request(method, f"{path}?{q}")
+            except ExchangeError as e:
+                # -1021: timestamp вне recvWindow — пересинхронизируемся и повторяем один раз
+                if e.code == -1021 and attempt == 0:
+                    await self.sync_time()
+                    continue
+                raise
+
+
+class OrderTracker:
+    """Состояние ордеров по clientOrderId; обновляется ответами и executionReport из user-data stream."""
+
+    def __init__(self):
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+    def _update(self, cid: str, **fields: Any) -> Dict[str, Any]:
+        o = self.orders.setdefault(cid, {"client_order_id": cid})
+        o.update({k: v for k, v in fields.items() if v is not None})
+        if o.get("status") in FINAL_STATUSES:
+            for fut in self._waiters.pop(cid, []):
+                if not fut.done():
+                    fut.set_result(dict(o))
+        return o
+
+    def on_ack(self, resp: Dict[str, Any]) -> Dict[str, Any]:
+        return self._update(
+            resp["clientOrderId"], order_id=resp.get("orderId"), symbol=resp.get("symbol"),
+            side=resp.get("side"), status=resp.get("status"),
+            executed_qty=resp.get("executedQty"), quote_qty=resp.get("cummulativeQuoteQty"),
+        )
+
+    def on_event(self, ev: Dict[str, Any]) -> None:
+        if ev.get("e") != "executionReport":
+            return
+        # при отмене клиентский id исходного ордера лежит в "C"
+        cid = ev.get("C") or ev.get("c")
+        self._update(
+            cid, order_id=ev.get("i"), symbol=ev.get("s"), side=ev.get("S"), status=ev.get("X"),
+            executed_qty=ev.get("z"), quote_qty=ev.get("Z"), last_price=ev.get("L"), update_ms=ev.get("E"),
+        )
+
+    async def wait_final(self, cid: str, timeout: float = 10.0) -> Dict[str, Any]:
+        o = self.orders.get(cid)
+        if o and o.get("status") in FINAL_STATUSES:
+            return dict(o)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(cid, []).append(fut)
+        return await asyncio.wait_for(fut, timeout)
+
+
+class UserDataStream:
+    """listenKey + websocket-поток executionReport → OrderTracker."""
+
+    def __init__(self, client: BinanceClient, on_event: Callable[[Dict[str, Any]], None], ws_url: str):
+        self.client = client
+        self.on_event = on_event
+        self.ws_url = ws_url.rstrip("/")
+        self.listen_key: str | None = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        data = await self.client.keyed("POST", "/api/v3/userDataStream")
+        self.listen_key = data["listenKey"]
+        self._tasks.append(asyncio.create_task(self._keepalive()))
+        if websockets is not None:
+            self._tasks.append(asyncio.create_task(self._reader()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        self._tasks.clear()
+        if self.listen_key:
+            try:
+                await self.client.keyed("DELETE", "/api/v3/userDataStream", {"listenKey": self.listen_key})
+            except Exception:
+                pass
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(LISTEN_KEY_KEEPALIVE_SEC)
+            try:
+                await self.client.keyed("PUT", "/api/v3/userDataStream", {"listenKey": self.listen_key})
+            except Exception:
+                pass
+
+    async def _reader(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(f"{self.ws_url}/{self.listen_key}") as ws:
+                    backoff = 1.0
+                    async for msg in ws:
+                        self.on_event(json.loads(msg))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+
+class ExecutionEngine:
+    """MARKET-ордера с локальным округлением под фильтры и параллельной отправкой пачки."""
+
+    def __init__(self, client: BinanceClient, ws_url: str | None = None):
+        self.client = client
+        self.tracker = OrderTracker()
+        self.filters: Dict[str, SymbolFilters] = {}
+        self.stream = UserDataStream(client, self.tracker.on_event, ws_url) if ws_url else None
+        self.last_latency_ms: float | None = None
+        self._sync_task: asyncio.Task | None = None
+
+    async def start(self, symbols: List[str] | None = None) -> None:
+        await self.client.sync_time()
+        if symbols:
+            await self.load_filters(symbols)
+        if self.stream:
+            await self.stream.start()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        if self._sync_task:
+            self._sync_task.cancel()
+        if self.stream:
+            await self.stream.stop()
+        await self.client.close()
+
+    async def _sync_loop(self) -> None:
+        # держим смещение времени свежим, а соединение — тёплым
+        while True:
+            await asyncio.sleep(TIME_SYNC_SEC)
+            try:
+                await self.client.sync_time()
+            except Exception:
+                pass
+
+    async def load_filters(self, symbols: List[str]) -> None:
+        missing = sorted({s.upper() for s in symbols} - self.filters.keys())
+        if not missing:
+            return
+        data = await self.client.public("GET", "/api/v3/exchangeInfo",
+                                        {"symbols": json.dumps(missing, separators=(",", ":"))})
+        for info in data.get("symbols", []):
+            self.filters[info["symbol"]] = SymbolFilters(info)
+
+    async def _filters_for(self, symbol: str) -> SymbolFilters:
+        if symbol not in self.filters:
+            await self.load_filters([symbol])
+        f = self.filters.get(symbol)
+        if f is None:
+            raise OrderError(f"{symbol}: unknown symbol")
+        return f
+
+    async def market_order(self, symbol: str, side: str, qty: float | None = None,
+                           quote_qty: float | None = None, price_hint: float | None = None) -> Dict[str, Any]:
+        symbol = symbol.upper()
+        f = await self._filters_for(symbol)
+        cid = f"mp{uuid.uuid4().hex[:22]}"
+        params: Dict[str, Any] = {
+            "symbol": symbol, "side": side, "type": "MARKET",
+            "newClientOrderId": cid, "newOrderRespType": "FULL",
+        }
+        if qty is not None:
+            q = f.round_qty(qty)
+            err = f.check(q, price_hint)
+            if err:
+                raise OrderError(err)
+            params["quantity"] = _fmt(q)
+        elif quote_qty is not None:
+            qq = f.round_quote(quote_qty)
+            if qq <= 0 or (f.min_notional > 0 and qq < f.min_notional):
+                raise OrderError(f"{symbol}: quote amount below {_fmt(f.min_notional)}")
+            params["quoteOrderQty"] = _fmt(qq)
+        else:
+            raise OrderError("qty or quote_qty required")
+
+        t0 = time.perf_counter()
+        try:
+            resp = await self.client.signed("POST", "/api/v3/order", params)
+        except ExchangeError as e:
+            if e.status < 500:
+                raise   # 4xx — биржа ордер отклонила
+            resp = await self._reconcile(symbol, cid, e)
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            resp = await self._reconcile(symbol, cid, e)
+        self.last_latency_ms = round((time.perf_counter() - t0) * 1000, 3)
+        self.tracker.on_ack(resp)
+
+        executed = _dec(resp.get("executedQty"))
+        quote = _dec(resp.get("cummulativeQuoteQty"))
+        # комиссия в базовом активе уменьшает реально полученное количество
+        fee_base = sum((_dec(x.get("commission")) for x in resp.get("fills", [])
+                        if x.get("commissionAsset") == f.base_asset), Decimal(0))
+        net = executed - fee_base if side == "BUY" else executed
+        return {
+            "symbol": symbol,
+            "side": side,
+            "order_id": resp.get("orderId"),
+            "client_order_id": cid,
+            "status": resp.get("status"),
+            "executed_qty": float(executed),
+            "net_qty": float(f.round_qty(net)) if net > 0 else 0.0,
+            "quote_qty": float(quote),
+            "avg_price": float(quote / executed) if executed > 0 else None,
+            "latency_ms": self.last_latency_ms,
+        }
+
+    async def _reconcile(self, symbol: str, cid: str, err: Exception) -> Dict[str, Any]:
+        """Ответ на POST /order потерян (таймаут, 5xx): ордер мог исполниться. Статус — из user-data stream
+        или GET /api/v3/order по clientOrderId; ошибкой считаем, только когда биржа ответила, что ордера нет."""
+        if self.stream is not None:
+            try:
+                await self.tracker.wait_final(cid, RECONCILE_WAIT_SEC)
+            except asyncio.TimeoutError:
+                pass
+        for attempt in range(RECONCILE_ATTEMPTS):
+            try:
+                o = await self.client.signed("GET", "/api/v3/order", {"symbol": symbol, "origClientOrderId": cid})
+            except ExchangeError as e:
+                if e.code == -2013:
+                    raise OrderError(f"{symbol}: order not placed ({err})") from e
+                if e.status < 500:
+                    raise
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                pass
+            else:
+                if o.get("status") in FINAL_STATUSES:
+                    # в ответе GET /order нет fills — комиссию берём из сделок ордера
+                    try:
+                        o["fills"] = await self.client.signed(
+                            "GET", "/api/v3/myTrades", {"symbol": symbol, "orderId": o["orderId"]})
+                    except Exception:
+                        o["fills"] = []   # исполнение важнее точной комиссии: позицию не теряем
+                    return o
+            await asyncio.sleep(RECONCILE_DELAY_SEC * (attempt + 1))
+        raise OrderError(f"{symbol}: order {cid} status unknown after {err}")
+
+    async def execute_many(self, orders: List[Dict[str, Any]]) -> List[Dict[str, Any] | Exception]:
+        # входы и выходы одного тика уходят параллельно по общему пулу соединений
+        return await asyncio.gather(*[self.market_order(**o) for o in orders], return_exceptions=True)
+
+
+_engine: ExecutionEngine | None = None
+_engine_lock: asyncio.Lock | None = None
+
+
+async def get_engine(symbols: List[str] | None = None) -> ExecutionEngine:
+    global _engine, _engine_lock
+    if not live_allowed() and not config.exchange_stub:
+        # последний рубеж: к настоящей бирже — только при TRADE_MODE=live и LIVE_ENABLED=true
+        raise OrderError("live disabled: set TRADE_MODE=live and LIVE_ENABLED=true")
+    if _engine is not None:
+        return _engine
+    if _engine_lock is None:
+        _engine_lock = asyncio.Lock()
+    async with _engine_lock:
+        if _engine is None:
+            if config.exchange_stub:
+                from app.services.exchange_stub import StubExchange
+                stub = StubExchange()
+                engine = ExecutionEngine(stub.client())
+                stub.subscribe(engine.tracker.on_event)
+            else:
+                if not config.binance_key or not config.binance_secret:
+                    raise OrderError("BINANCE_KEY/BINANCE_SECRET are not set")
+                client = BinanceClient(config.binance_key, config.binance_secret,
+                                       config.binance_base_url, config.binance_recv_window)
+                engine = ExecutionEngine(client, config.binance_ws_url)
+            await engine.start(symbols)
+            _engine = engine
+    return _engine
+
+
+async def close_engine() -> None:
+    global _engine
+    if _engine is not None:
+        await _engine.stop()
+        _engine = None
@@ -0,0 +1,219 @@
+# app/services/history.py
+from __future__ import annotations
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Tuple
+import gzip, json, os
+from app.services.portfolios import Portfolio
+from app.utils.storage import write_json_atomic
+
+# История закрытых сделок портфеля:
+#   trades_closed.json   — «горячие» последние сделки (по времени, новые в конце)
+#   history/seg_*.json.gz — сжатые сегменты старых сделок
+#   trades_history.json  — роллапы по дням/символам/итогу + индекс сегментов; обновляются инкрементально
+
+HOT_MAX = int(os.getenv("HISTORY_HOT_MAX", "1000"))       # при превышении — сброс в сегмент
+SEGMENT_SIZE = int(os.getenv("HISTORY_SEGMENT_SIZE", "500"))
+
+
+def _rj(p, default):
+    if not p.exists(): return default
+    try:
+        with p.open("r", encoding="utf-8") as f: return json.load(f)
+    except Exception: return default
+
+def _wj(p, data):
+    write_json_atomic(p, data, indent=2)
+
+def _today_str() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def _empty_agg() -> Dict[str, float]:
+    return {"count": 0, "wins": 0, "pnl": 0.0, "gross_profit": 0.0, "gross_loss": 0.0, "duration_sec": 0.0}
+
+def _empty_meta() -> Dict[str, Any]:
+    return {"total": {**_empty_agg(), "cum_min": 0.0}, "days": {}, "symbols": {}, "segments": []}
+
+def _add(agg: Dict[str, float], row: Dict[str, Any]) -> None:
+    pnl = float(row.get("pnl_usdc", 0.0))
+    agg["count"] += 1
+    agg["pnl"] = round(agg["pnl"] + pnl, 6)
+    if pnl > 0:
+        agg["wins"] += 1
+        agg["gross_profit"] = round(agg["gross_profit"] + pnl, 6)
+    else:
+        agg["gross_loss"] = round(agg["gross_loss"] + pnl, 6)
+    agg["duration_sec"] = round(agg["duration_sec"] + float(row.get("duration_sec") or 0.0), 3)
+
+def _apply(meta: Dict[str, Any], row: Dict[str, Any]) -> None:
+    tot = meta["total"]
+    _add(tot, row)
+    # max drawdown как в сводке: минимум кумулятивного PnL
+    tot["cum_min"] = round(min(tot["cum_min"], tot["pnl"]), 6)
+    day = (row.get("exit_time") or "")[:10] or _today_str()
+    _add(meta["days"].setdefault(day, _empty_agg()), row)
+    _add(meta["symbols"].setdefault(row.get("symbol", "?"), _empty_agg()), row)
+
+def stats(agg: Dict[str, float]) -> Dict[str, Any]:
+    n = agg["count"]
+    return {
+        "trades": n,
+        "wins": agg["wins"],
+        "pnl_usdc": round(agg["pnl"], 6),
+        "win_rate": round(100.0 * agg["wins"] / max(1, n), 2),
+        "avg_pnl_usdc": round(agg["pnl"] / max(1, n), 6),
+        "avg_duration_sec": round(agg["duration_sec"] / max(1, n), 3),
+        "gross_profit_usdc": round(agg["gross_profit"], 6),
+        "gross_loss_usdc": round(agg["gross_loss"], 6),
+    }
+
+
+# ---- сегменты
+def _seg_path(pf: Portfolio, name: str):
+    return pf.seg_dir / name
+
+def _read_segment(pf: Portfolio, name: str) -> List[Dict[str, Any]]:
+    try:
+        with gzip.open(_seg_path(pf, name), "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+def _write_segment(pf: Portfolio, rows: List[Dict[str, Any]], meta: Dict[str, Any]) -> None:
+    pf.seg_dir.mkdir(parents=True, exist_ok=True)
+    n = int(meta["segments"][-1]["file"][4:10]) + 1 if meta["segments"] else 0
+    name = f"seg_{n:06d}.json.gz"
+    tmp = _seg_path(pf, name + ".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, _seg_path(pf, name))
+    meta["segments"].append({
+        "file": name, "count": len(rows),
+        "first_exit": rows[0].get("exit_time"), "last_exit": rows[-1].get("exit_time"),
+    })
+
+def _compact(pf: Portfolio, hot: List[Dict[str, Any]], meta: Dict[str, Any]) -> List[Dict[str, Any]]:
+    while len(hot) > HOT_MAX:
+        _write_segment(pf, hot[:SEGMENT_SIZE], meta)
+        hot = hot[SEGMENT_SIZE:]
+    return hot
+
+
+# ---- публичное API
+def load_meta(pf: Portfolio, migrate: bool = False) -> Dict[str, Any]:
+    """Роллапы. Без файла по умолчанию считаются в памяти и не пишутся: GET без блокировки мог бы
+    затереть сделки, дописанные тиком. migrate=True (только под portfolio_lock) — пересобрать и записать."""
+    meta = _rj(pf.f_hist, None)
+    if meta is None:
+        meta = rebuild(pf) if migrate else _build(pf)[0]
+    return meta
+
+def _build(pf: Portfolio) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    meta = _empty_meta()
+    seg_rows: List[Dict[str, Any]] = []
+    # индекс сегментов восстанавливаем по файлам — он мог потеряться вместе с роллапами
+    for p in sorted(pf.seg_dir.glob("seg_*.json.gz")) if pf.seg_dir.is_dir() else []:
+        rows = _read_segment(pf, p.name)
+        if not rows:
+            continue
+        seg_rows += rows
+        meta["segments"].append({"file": p.name, "count": len(rows),
+                                 "first_exit": rows[0].get("exit_time"), "last_exit": rows[-1].get("exit_time")})
+    hot = _rj(pf.f_closed, [])
+    # раньше тик писал новые сделки в начало — приводим к порядку по времени выхода
+    hot.sort(key=lambda x: x.get("exit_time", ""))
+    for row in seg_rows + hot:
+        _apply(meta, row)
+    return meta, hot
+
+def rebuild(pf: Portfolio) -> Dict[str, Any]:
+    """Пересобрать роллапы из горячего списка и сегментов (миграция старых trades_closed.json).
+    Пишет файлы — вызывать под portfolio_lock."""
+    meta, hot = _build(pf)
+    hot = _compact(pf, hot, meta)
+    _wj(pf.f_closed, hot)
+    _wj(pf.f_hist, meta)
+    return meta
+
+def record_closed(pf: Portfolio, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Добавить закрытые сделки: горячий список + инкрементальное обновление роллапов (под portfolio_lock)."""
+    meta = load_meta(pf, migrate=True)
+    hot = _rj(pf.f_closed, [])
+    for row in rows:
+        hot.append(row)
+        _apply(meta, row)
+    hot = _compact(pf, hot, meta)
+    _wj(pf.f_closed, hot)
+    _wj(pf.f_hist, meta)
+    return meta
+
+def load_closed(pf: Portfolio, limit: int = 200) -> List[Dict[str, Any]]:
+    hot = _rj(pf.f_closed, [])
+    if limit <= len(hot):
+        return hot[-limit:] if limit > 0 else []
+    # не хватило горячих — дочитываем сегменты с конца
+    out = hot
+    for s in reversed(load_meta(pf).get("segments", [])):
+        out = _read_segment(pf, s["file"]) + out
+        if len(out) >= limit:
+            break
+    return out[-limit:]
+
+def reset(pf: Portfolio) -> None:
+    # все сегменты в папке, а не только из индекса: иначе rebuild() вернул бы сброшенные сделки
+    for p in pf.seg_dir.glob("seg_*.json.gz*") if pf.seg_dir.is_dir() else []:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+    _wj(pf.f_closed, [])
+    _wj(pf.f_hist, _empty_meta())
+
+
+# ---- аналитика из роллапов
+def day_pnl(meta: Dict[str, Any], day: str | None = None) -> float:
+    """Реализованный PnL за день (UTC) по дате закрытия; по умолчанию — сегодня."""
+    return float(meta["days"].get(day or _today_str(), {}).get("pnl", 0.0))
+
+def summary_fields(meta: Dict[str, Any]) -> Dict[str, Any]:
+    tot = meta["total"]
+    today = meta["days"].get(_today_str(), _empty_agg())
+    return {
+        "closed_count": tot["count"],
+        "realized_pnl_usdc_total": round(tot["pnl"], 6),
+        "realized_pnl_usdc_today": round(today["pnl"], 6),
+        "win_rate": round(100.0 * tot["wins"] / max(1, tot["count"]), 2),
+        "avg_pnl_usdc": round(tot["pnl"] / max(1, tot["count"]), 6),
+        "max_drawdown_usdc": round(-tot["cum_min"], 6),
+    }
+
+def _in_range(day: str, start: str | None, end: str | None) -> bool:
+    return (not start or day >= start) and (not end or day <= end)
+
+def equity_curve(meta: Dict[str, Any], start: str | None = None, end: str | None = None) -> List[Dict[str, Any]]:
+    cum = 0.0
+    out = []
+    for day in sorted(meta["days"]):
+        agg = meta["days"][day]
+        cum += agg["pnl"]
+        if _in_range(day, start, end):
+            out.append({"date": day, "pnl_usdc": round(agg["pnl"], 6), "equity_usdc": round(cum, 6), "trades": agg["count"]})
+    return out
+
+def by_symbol(meta: Dict[str, Any]) -> List[Dict[str, Any]]:
+    rows = [{"symbol": sym, **stats(agg)} for sym, agg in meta["symbols"].items()]
+    rows.sort(key=lambda r: r["pnl_usdc"], reverse=True)
+    return rows
+
+def range_stats(meta: Dict[str, Any], start: str | None = None, end: str | None = None) -> Dict[str, Any]:
+    agg = _empty_agg()
+    cum, peak, max_dd = 0.0, 0.0, 0.0
+    for day in sorted(meta["days"]):
+        if not _in_range(day, start, end):
+            continue
+        d = meta["days"][day]
+        for k in agg:
+            agg[k] += d[k]
+        cum += d["pnl"]
+        peak = max(peak, cum)
+        max_dd = max(max_dd, peak - cum)
+    return {"start": start, "end": end, **stats(agg), "max_daily_drawdown_usdc": round(max_dd, 6)}
@@ -0,0 +1,198 @@
+# app/services/leader.py
+from __future__ import annotations
+import asyncio, json, os, socket, sqlite3, time, uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from app.services.portfolios import DB, list_portfolios
+from app.services.tick import run_tick
+
+# Лидерство для нескольких воркеров/инстансов: аренда (lease) в строке SQLite с heartbeat и сроком.
+# Тик/сбор данных выполняет только лидер; остальные отдают чтение из общих JSON-файлов,
+# а POST /tick на них ставит запрос, который лидер подхватывает при следующей проверке.
+
+LEASE_DB = Path(os.getenv("LEADER_DB", str(DB / "leader.sqlite")))
+LEASE_TTL = float(os.getenv("LEADER_LEASE_SEC", "15"))
+POLL_SEC = 1.0
+
+
+class Lease:
+    def __init__(self, name: str = "tick", path: Path = LEASE_DB, ttl: float = LEASE_TTL):
+        self.name = name
+        self.path = path
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self.expires_at = 0.0
+        self.term = 0
+        self.leader: str | None = None
+
+    def _conn(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")   # файл общий с лентой событий: чтение не ждёт записи
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, holder TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, term INTEGER NOT NULL, tick_requested REAL NOT NULL DEFAULT 0)"
+        )
+        return con
+
+    def try_acquire(self) -> bool:
+        """Взять или продлить аренду; атомарно в одной IMMEDIATE-транзакции."""
+        now = time.time()
+        con = self._conn()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("INSERT OR IGNORE INTO lease (name, holder, expires_at, term) VALUES (?, '', 0, 0)", (self.name,))
+            con.execute(
+                "UPDATE lease SET term = CASE WHEN holder = ? THEN term ELSE term + 1 END, holder = ?, expires_at = ? "
+                "WHERE name = ? AND (holder = ? OR expires_at < ?)",
+                (self.holder, self.holder, now + self.ttl, self.name, self.holder, now),
+            )
+            holder, expires_at, term = con.execute(
+                "SELECT holder, expires_at, term FROM lease WHERE name = ?", (self.name,)
+            ).fetchone()
+            con.execute("COMMIT")
+        finally:
+            con.close()
+        self.leader = holder
+        self.term = term
+        self.is_leader = holder == self.holder
+        self.expires_at = expires_at if self.is_leader else 0.0
+        return self.is_leader
+
+    def valid(self) -> bool:
+        # запас в одну секунду на дрейф часов между процессами
+        return self.is_leader and time.time() < self.expires_at - 1.0
+
+    def release(self) -> None:
+        con = self._conn()
+        try:
+            con.execute("UPDATE lease SET expires_at = 0 WHERE name = ? AND holder = ?", (self.name, self.holder))
+        finally:
+            con.close()
+        self.is_leader = False
+
+    def request_tick(self) -> None:
+        con = self._conn()
+        try:
+            con.execute("INSERT OR IGNORE INTO lease (name, holder, expires_at, term) VALUES (?, '', 0, 0)", (self.name,))
+            con.execute("UPDATE lease SET tick_requested = ? WHERE name = ?", (time.time(), self.name))
+        finally:
+            con.close()
+
+    def tick_requested(self) -> float:
+        con = self._conn()
+        try:
+            row = con.execute("SELECT tick_requested FROM lease WHERE name = ?", (self.name,)).fetchone()
+        finally:
+            con.close()
+        return float(row[0]) if row else 0.0
+
+    def info(self) -> Dict[str, Any]:
+        return {"is_leader": self.is_leader, "self": self.holder, "leader": self.leader, "term": self.term}
+
+
+def _autotrade_interval() -> float | None:
+    # минимальный tick_interval_sec среди портфелей с autotrade_enabled
+    out = None
+    for pf in list_portfolios():
+        try:
+            st = json.loads(pf.f_set.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        if st.get("autotrade_enabled"):
+            iv = max(5.0, float(st.get("tick_interval_sec", 30)))
+            out = iv if out is None else min(out, iv)
+    return out
+
+
+class Leadership:
+    def __init__(self, lease: Lease, tick_fn: Callable[[], Any]):
+        self.lease = lease
+        self.tick_fn = tick_fn
+        self.on_elected: List[Callable[[], Any]] = []
+        self.on_demoted: List[Callable[[], Any]] = []
+        self.last_tick_at = 0.0
+        self._seen_request = 0.0
+        self._interval: float | None = None
+        self._tick_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lease.valid()
+
+    async def _beat(self) -> None:
+        was = self.lease.is_leader
+        try:
+            await asyncio.to_thread(self.lease.try_acquire)
+        except Exception:
+            self.lease.is_leader = False   # не можем подтвердить аренду — считаем себя ведомым
+        if self.lease.is_leader and not was:
+            # старые запросы тика, пришедшие до избрания, уже обработал прежний лидер
+            self._seen_request = await asyncio.to_thread(self.lease.tick_requested)
+            await self._fire(self.on_elected)
+        elif was and not self.lease.is_leader:
+            await self._fire(self.on_demoted)
+        if self.lease.is_leader:
+            self._interval = await asyncio.to_thread(_autotrade_interval)
+
+    @staticmethod
+    async def _fire(callbacks: List[Callable[[], Any]]) -> None:
+        for cb in callbacks:
+            try:
+                r = cb()
+                if asyncio.iscoroutine(r):
+                    await r
+            except Exception:
+                pass
+
+    async def start(self) -> None:
+        await self._beat()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.lease.is_leader:
+            # отдаём аренду сразу, чтобы другой воркер подхватил без ожидания TTL
+            await asyncio.to_thread(self.lease.release)
+            await self._fire(self.on_demoted)
+
+    async def _loop(self) -> None:
+        last_beat = time.time()
+        while True:
+            await asyncio.sleep(POLL_SEC)
+            now = time.time()
+            if now - last_beat >= self.lease.ttl / 3:
+                await self._beat()
+                last_beat = now
+            if not self.is_leader:
+                continue
+            try:
+                req = await asyncio.to_thread(self.lease.tick_requested)
+                due = self._interval is not None and now - self.last_tick_at >= self._interval
+                if (req > self._seen_request or due) and not self._tick_lock.locked():
+                    self._seen_request = max(self._seen_request, req)
+                    # тик — отдельной задачей, чтобы heartbeat не вставал на время тика
+                    asyncio.create_task(self.run_tick())
+            except Exception:
+                pass
+
+    async def run_tick(self) -> Dict[str, Any]:
+        async with self._tick_lock:
+            if not self.is_leader:
+                return {"processed": 0, "opened": 0, "closed": 0, "errors": ["not leader"]}
+            self.last_tick_at = time.time()
+            try:
+                return await self.tick_fn()
+            except Exception as e:
+                return {"processed": 0, "opened": 0, "closed": 0, "errors": [f"tick: {e}"]}
+
+    async def request_tick(self) -> None:
+        await asyncio.to_thread(self.lease.request_tick)
+
+
+leadership = Leadership(Lease(), run_tick)
@@ -0,0 +1,145 @@
+# app/services/portfolios.py
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List
+import asyncio, re, shutil, threading
+from fastapi import HTTPException
+
+try:
+    import fcntl
+except ImportError:     # не POSIX: блокировка только в пределах процесса
+    fcntl = None
+
+# Портфель = свой settings.json + trades_*.json. "default" живёт прямо в app/db (как раньше),
+# остальные — в app/db/portfolios/<id>/.
+
+ROOT = Path(__file__).resolve().parents[1]
+DB = ROOT / "db"
+PF_DIR = DB / "portfolios"
+DEFAULT_ID = "default"
+_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,40}$")
+
+
+class Portfolio:
+    __slots__ = ("id", "dir", "f_set", "f_open", "f_closed", "f_sum", "f_hist", "seg_dir")
+
+    def __init__(self, pid: str):
+        self.id = pid
+        self.dir = DB if pid == DEFAULT_ID else PF_DIR / pid
+        self.f_set = self.dir / "settings.json"
+        self.f_open = self.dir / "trades_open.json"
+        self.f_closed = self.dir / "trades_closed.json"
+        self.f_sum = self.dir / "trades_summary.json"
+        self.f_hist = self.dir / "trades_history.json"   # роллапы + индекс сегментов
+        self.seg_dir = self.dir / "history"               # сжатые сегменты старых сделок
+
+    def exists(self) -> bool:
+        return self.id == DEFAULT_ID or self.dir.is_dir()
+
+
+class PortfolioGone(HTTPException):
+    """Портфель удалён (в том числе пока ждали его блокировку)."""
+
+    def __init__(self, pid: str):
+        super().__init__(404, detail="portfolio not found")
+        self.pid = pid
+
+
+class PortfolioLock:
+    """Эксклюзивная блокировка чтения-изменения-записи файлов портфеля: flock на <dir>/.lock,
+    общий для потоков и воркеров. Sync — в эндпоинтах (threadpool), async — в тике."""
+
+    _local: Dict[str, threading.Lock] = {}
+
+    def __init__(self, pf: Portfolio):
+        self.pf = pf
+        self.path = pf.dir / ".lock"
+        self._f = None
+
+    def acquire(self) -> None:
+        # папку создаём только для default: удалённый портфель не должен воскресать из-за блокировки
+        if self.pf.id == DEFAULT_ID:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            PortfolioLock._local.setdefault(str(self.path), threading.Lock()).acquire()
+        else:
+            try:
+                f = open(self.path, "a")
+            except FileNotFoundError:
+                raise PortfolioGone(self.pf.id) from None
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            except BaseException:
+                f.close()
+                raise
+            self._f = f
+        if not self.pf.exists():
+            # удалили, пока ждали блокировку
+            self.release()
+            raise PortfolioGone(self.pf.id)
+
+    def release(self) -> None:
+        if fcntl is None:
+            PortfolioLock._local[str(self.path)].release()
+            return
+        f, self._f = self._f, None
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+    def __enter__(self) -> "PortfolioLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    async def __aenter__(self) -> "PortfolioLock":
+        # ждём в потоке, чтобы не держать event loop, пока файл пишет соседний воркер
+        fut = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # поток всё равно возьмёт блокировку — отпускаем сразу, как только возьмёт
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception() or self.release())
+            raise
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+def portfolio_lock(pf: Portfolio) -> PortfolioLock:
+    return PortfolioLock(pf)
+
+
+def valid_id(pid: str) -> bool:
+    return bool(_ID_RE.match(pid or ""))
+
+def list_portfolios() -> List[Portfolio]:
+    out = [Portfolio(DEFAULT_ID)]
+    if PF_DIR.is_dir():
+        out += [Portfolio(p.name) for p in sorted(PF_DIR.iterdir())
+                if p.is_dir() and valid_id(p.name) and p.name != DEFAULT_ID]
+    return out
+
+def get_portfolio(pid: str) -> Portfolio | None:
+    if not valid_id(pid):
+        return None
+    pf = Portfolio(pid)
+    return pf if pf.exists() else None
+
+def create_portfolio(pid: str) -> Portfolio:
+    pf = Portfolio(pid)
+    pf.dir.mkdir(parents=True, exist_ok=True)
+    return pf
+
+def delete_portfolio(pid: str) -> None:
+    # вызывать под portfolio_lock: тик и эндпоинты, ждущие блокировку, увидят PortfolioGone
+    shutil.rmtree(Portfolio(pid).dir, ignore_errors=True)
+
+def portfolio_dep(pid: str = DEFAULT_ID) -> Portfolio:
+    # на /portfolios/{pid}/... — path-параметр, на старых путях — ?pid=, по умолчанию "default"
+    pf = get_portfolio(pid)
+    if pf is None:
+        raise HTTPException(404, detail="portfolio not found")
+    return pf
@@ -0,0 +1,160 @@
+# app/services/prices.py
+from __future__ import annotations
+import asyncio, json, os, time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+import httpx
+from app.utils.storage import write_json_atomic
+
+ENDPOINTS: List[str] = [
+    "https://api.binance.com",
+    "https://data-api.binance.vision",
+]
+
+# снимок кэша на диске: лидер пишет, остальные воркеры читают вместо похода на биржу
+SNAPSHOT = Path(__file__).resolve().parents[1] / "db" / "prices.json"
+
+REFRESH_SEC = float(os.getenv("PRICE_REFRESH_SEC", "5"))
+MAX_AGE_SEC = float(os.getenv("PRICE_MAX_AGE_SEC", "30"))
+
+
+class PriceCache:
+    """Общий кэш bid/ask/last по всем символам; обновляется одним bulk-запросом bookTicker."""
+
+    def __init__(self):
+        self.book: Dict[str, Tuple[float, float, float]] = {}   # symbol -> (bid, ask, ts)
+        self.last: Dict[str, Tuple[float, float]] = {}          # symbol -> (price, ts)
+        self.updated_at = 0.0
+        self._http: httpx.AsyncClient | None = None
+        self._refreshing: asyncio.Task | None = None
+        self._task: asyncio.Task | None = None
+        self.publish_snapshot = False
+        self._snapshot_mtime = 0
+        self.listeners: List[Callable[[str, float, float], None]] = []   # (symbol, bid, ask)
+
+    # ---- запись
+    def update_book(self, rows: List[Dict[str, Any]]) -> int:
+        now = time.time()
+        n = 0
+        for r in rows:
+            try:
+                bid, ask = float(r["bidPrice"]), float(r["askPrice"])
+            except Exception:
+                continue
+            if bid <= 0 or ask <= 0:
+                continue
+            self.book[r["symbol"]] = (bid, ask, now)
+            n += 1
+            for fn in self.listeners:
+                fn(r["symbol"], bid, ask)
+        self.updated_at = now
+        return n
+
+    def update_last(self, symbol: str, price: float) -> None:
+        if price > 0:
+            self.last[symbol] = (float(price), time.time())
+            for fn in self.listeners:
+                fn(symbol, float(price), float(price))
+
+    # ---- чтение (без сетевых вызовов)
+    def price(self, symbol: str, side: str | None = None) -> float | None:
+        b = self.book.get(symbol)
+        if b:
+            bid, ask, _ = b
+            if side == "BUY":
+                return ask
+            if side == "SELL":
+                return bid
+            return (bid + ask) / 2
+        l = self.last.get(symbol)
+        return l[0] if l else None
+
+    def age_sec(self) -> float | None:
+        return round(time.time() - self.updated_at, 3) if self.updated_at else None
+
+    # ---- снимок для других воркеров
+    def save_snapshot(self) -> None:
+        data = {"updated_at": self.updated_at, "book": {s: [b, a] for s, (b, a, _) in self.book.items()}}
+        write_json_atomic(SNAPSHOT, data, separators=(",", ":"))
+
+    def load_snapshot(self) -> bool:
+        try:
+            mtime = SNAPSHOT.stat().st_mtime_ns
+            if mtime == self._snapshot_mtime:
+                return False
+            with SNAPSHOT.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return False
+        ts = float(data.get("updated_at", 0.0))
+        if ts <= self.updated_at:
+            return False
+        self.book = {s: (float(b), float(a), ts) for s, (b, a) in data.get("book", {}).items()}
+        self.updated_at = ts
+        self._snapshot_mtime = mtime
+        return True
+
+    # ---- обновление
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=10.0, follow_redirects=True)
+        return self._http
+
+    async def _fetch(self) -> int:
+        last_err = None
+        for base in ENDPOINTS:
+            try:
+                r = await self._client().get(f"{base}/api/v3/ticker/bookTicker")
+                r.raise_for_status()
+                data = r.json()
+                if isinstance(data, list) and data:
+                    n = self.update_book(data)
+                    if self.publish_snapshot:
+                        self.save_snapshot()
+                    return n
+            except Exception as e:
+                last_err = e
+        raise RuntimeError(f"Failed to fetch bookTicker: {last_err}")
+
+    async def refresh(self) -> int:
+        # single-flight: параллельные вызовы ждут один и тот же запрос
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._fetch())
+        return await asyncio.shield(self._refreshing)
+
+    async def ensure_fresh(self, max_age: float = MAX_AGE_SEC) -> None:
+        age = self.age_sec()
+        if not self.publish_snapshot and (age is None or age > REFRESH_SEC):
+            # ведомый воркер: сначала снимок лидера (файл читается, только если изменился)
+            self.load_snapshot()
+            age = self.age_sec()
+        if age is None or age > max_age:
+            try:
+                await self.refresh()
+            except Exception:
+                pass  # отдаём то, что есть в кэше
+
+    async def _loop(self, interval: float) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                pass
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = REFRESH_SEC) -> None:
+        self.publish_snapshot = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(interval))
+
+    async def stop(self) -> None:
+        self.publish_snapshot = False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+price_cache = PriceCache()
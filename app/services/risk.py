@@ -0,0 +1,225 @@
+# app/services/risk.py
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Set
+import json, threading
+
+from app.services import history
+from app.services.portfolios import Portfolio
+from app.services.prices import price_cache
+
+# Риск в реальном времени: нереализованный PnL открытых позиций пересчитывается за O(1) на каждое
+# обновление цены символа, дневной убыток (реализованный + нереализованный) ведётся инкрементально,
+# при превышении max_daily_loss_usdc срабатывает kill switch: новые входы блокируются, позиции закрываются.
+# Источник истины по kill switch — trades_summary.json["kill_switch"] (общий для всех воркеров);
+# в памяти он лишь опережает файл на время от пробоя до записи.
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def _next_midnight_ts() -> float:
+    now = datetime.now(timezone.utc)
+    return (now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+
+def kill_active(kill: Dict[str, Any] | None, day: str | None = None) -> bool:
+    return bool(kill and kill.get("active") and kill.get("day") == (day or _today()))
+
+def risk_sized_notional(equity: float, risk_pct: float, stop_pct: float, cap: float) -> float:
+    """Размер позиции, при котором срабатывание стопа теряет risk_pct % от equity; не больше cap."""
+    if equity <= 0 or risk_pct <= 0 or stop_pct <= 0:
+        return max(0.0, cap)
+    return max(0.0, min(cap, equity * risk_pct / stop_pct))
+
+def cache_marks(open_trades: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Оценка позиций по кэшу цен: лонг — по bid, шорт — по ask."""
+    out: Dict[str, float] = {}
+    for t in open_trades:
+        p = price_cache.price(t["symbol"], "BUY" if t.get("side", "BUY") == "SELL" else "SELL")
+        if p:
+            out[t["symbol"]] = p
+    return out
+
+
+class _SymbolBook:
+    __slots__ = ("qty", "cost", "upnl")
+
+    def __init__(self):
+        self.qty = 0.0    # со знаком: BUY +, SELL -
+        self.cost = 0.0   # сумма qty * entry со знаком
+        self.upnl = 0.0
+
+
+class PortfolioRisk:
+    def __init__(self, pid: str):
+        self.pid = pid
+        self.max_daily_loss = 0.0
+        self.realized_today = 0.0
+        self.unrealized = 0.0
+        self.day = _today()
+        self.day_ends_at = _next_midnight_ts()
+        self.books: Dict[str, _SymbolBook] = {}
+        self.killed = False
+        self.kill_reason: str | None = None
+        self.unpersisted = False   # пробой случился здесь и ещё не записан в сводку
+
+    @property
+    def day_pnl(self) -> float:
+        return self.realized_today + self.unrealized
+
+    def _roll_day(self, now: float) -> None:
+        if now >= self.day_ends_at:
+            self.day = _today()
+            self.day_ends_at = _next_midnight_ts()
+            self.realized_today = 0.0
+            self.killed = False
+            self.kill_reason = None
+            self.unpersisted = False
+
+    def load(self, open_trades: List[Dict[str, Any]], realized_today: float, max_daily_loss: float,
+             marks: Dict[str, float], kill: Dict[str, Any] | None = None) -> None:
+        """Полная пересборка по состоянию из файлов (после тика/ручного открытия/закрытия).
+        realized_today — реализованный PnL именно за self.day; kill — запись из сводки (и взвод, и сброс)."""
+        self.max_daily_loss = float(max_daily_loss)
+        self.realized_today = float(realized_today)
+        books: Dict[str, _SymbolBook] = {}
+        for t in open_trades:
+            sign = 1.0 if t.get("side", "BUY") == "BUY" else -1.0
+            b = books.setdefault(t["symbol"], _SymbolBook())
+            q = sign * float(t["qty"])
+            b.qty += q
+            b.cost += q * float(t["entry_price"])
+        self.books = books
+        self.unrealized = 0.0
+        for sym, b in books.items():
+            price = marks.get(sym)
+            b.upnl = b.qty * price - b.cost if price else 0.0
+            self.unrealized += b.upnl
+        if kill_active(kill, self.day):
+            self.killed, self.kill_reason, self.unpersisted = True, kill.get("reason"), False
+        elif not self.unpersisted:
+            # сброшен (reset на любом воркере) или не взводился
+            self.killed, self.kill_reason = False, None
+
+    def on_price(self, symbol: str, bid: float, ask: float, now: float) -> bool:
+        """O(1): заменить вклад символа в нереализованный PnL. True — лимит только что пробит."""
+        b = self.books.get(symbol)
+        if b is None:
+            return False
+        self._roll_day(now)
+        # лонг оцениваем по bid, шорт — по ask (цена, по которой реально закроемся)
+        new = b.qty * (bid if b.qty >= 0 else ask) - b.cost
+        self.unrealized += new - b.upnl
+        b.upnl = new
+        return self.check()
+
+    def check(self) -> bool:
+        if self.killed or self.max_daily_loss <= 0:
+            return False
+        if -self.day_pnl >= self.max_daily_loss:
+            self.killed = True
+            self.unpersisted = True
+            self.kill_reason = f"daily loss {-self.day_pnl:.2f} >= {self.max_daily_loss:.2f} USDC"
+            return True
+        return False
+
+    def entry_budget(self) -> float:
+        """Сколько ещё можно потерять сегодня до дневного лимита."""
+        if self.max_daily_loss <= 0:
+            return float("inf")
+        return max(0.0, self.max_daily_loss + self.day_pnl)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "day": self.day,
+            "realized_today_usdc": round(self.realized_today, 6),
+            "unrealized_usdc": round(self.unrealized, 6),
+            "day_pnl_usdc": round(self.day_pnl, 6),
+            "max_daily_loss_usdc": self.max_daily_loss,
+            "entry_budget_usdc": round(self.entry_budget(), 6) if self.max_daily_loss > 0 else None,
+            "kill_switch": self.killed,
+            "reason": self.kill_reason,
+        }
+
+    def kill_record(self) -> Dict[str, Any]:
+        return {"active": self.killed, "day": self.day, "reason": self.kill_reason}
+
+
+class RiskEngine:
+    def __init__(self):
+        self.portfolios: Dict[str, PortfolioRisk] = {}
+        self.holders: Dict[str, Set[str]] = {}          # symbol -> портфели с позицией
+        self.on_breach: List[Callable[[str, Dict[str, Any]], Any]] = []   # (pid, kill_record)
+        self._lock = threading.Lock()
+
+    def sync(self, pf: Portfolio, open_trades: List[Dict[str, Any]], summary: Dict[str, Any],
+             settings: Dict[str, Any], marks: Dict[str, float], notify: bool = True) -> PortfolioRisk:
+        """Пересобрать риск портфеля и проверить лимит. Вызывающий пишет pr.kill_record() в сводку."""
+        # реализованный за сегодня — из дневных роллапов истории, а не из сводки (та могла остаться со вчера)
+        meta = history.load_meta(pf)
+        with self._lock:
+            pid = pf.id
+            pr = self.portfolios.get(pid) or PortfolioRisk(pid)
+            pr._roll_day(datetime.now(timezone.utc).timestamp())
+            pr.load(open_trades, history.day_pnl(meta, pr.day),
+                    settings.get("max_daily_loss_usdc", 25.0), marks, summary.get("kill_switch"))
+            breached = pr.check()
+            self.portfolios[pid] = pr
+            for s in self.holders.values():
+                s.discard(pid)
+            for sym in pr.books:
+                self.holders.setdefault(sym, set()).add(pid)
+        if breached and notify:
+            self._breach(pid, pr.kill_record())
+        return pr
+
+    def _breach(self, pid: str, kill: Dict[str, Any]) -> None:
+        for cb in self.on_breach:
+            try:
+                cb(pid, kill)
+            except Exception:
+                pass
+
+    def on_price(self, symbol: str, bid: float, ask: float) -> None:
+        pids = self.holders.get(symbol)
+        if not pids:
+            return
+        now = datetime.now(timezone.utc).timestamp()
+        breached = []
+        with self._lock:
+            for pid in list(pids):
+                pr = self.portfolios[pid]
+                if pr.on_price(symbol, bid, ask, now):
+                    breached.append((pid, pr.kill_record()))
+        for pid, kill in breached:
+            self._breach(pid, kill)
+
+    def reset(self, pid: str) -> None:
+        # ручной сброс портфеля снимает и kill switch
+        with self._lock:
+            self.portfolios.pop(pid, None)
+            for s in self.holders.values():
+                s.discard(pid)
+
+    def kill_state(self, pf: Portfolio) -> Dict[str, Any] | None:
+        """Действующий kill switch: запись в сводке (общая для воркеров) или свежий, ещё не записанный пробой."""
+        try:
+            kill = json.loads(pf.f_sum.read_text(encoding="utf-8")).get("kill_switch")
+        except Exception:
+            kill = None
+        if kill_active(kill):
+            return kill
+        pr = self.portfolios.get(pf.id)
+        if pr and pr.killed and pr.unpersisted:
+            return pr.kill_record()
+        return None
+
+    def is_killed(self, pf: Portfolio) -> bool:
+        return self.kill_state(pf) is not None
+
+    def status(self, pid: str) -> Dict[str, Any] | None:
+        pr = self.portfolios.get(pid)
+        return pr.status() if pr else None
+
+
+risk_engine = RiskEngine()
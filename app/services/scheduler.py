@@ -0,0 +1,194 @@
+# app/services/scheduler.py
+from __future__ import annotations
+import math, os, statistics, time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from app.services.market import top_by_quote
+from app.services.candles import candle_feed
+
+# Планировщик опроса символов: вместо «все символы каждый тик» — приоритеты и бюджет запросов в минуту.
+# Ранг символа = ликвидность (24h quoteVolume) + недавняя волатильность (1m); символы с открытой позицией
+# опрашиваются всегда. Горячие — каждый тик, тёплые — раз в WARM_SEC, холодные — раз в COLD_SEC,
+# а сверху всё ограничено token bucket на BUDGET_PER_MIN запросов к бирже.
+
+BUDGET_PER_MIN = float(os.getenv("SCHED_REQUESTS_PER_MIN", "300"))
+WARM_SEC = float(os.getenv("SCHED_WARM_SEC", "60"))
+COLD_SEC = float(os.getenv("SCHED_COLD_SEC", "300"))
+UNIVERSE_REFRESH_SEC = float(os.getenv("UNIVERSE_REFRESH_SEC", "900"))
+HOT_SHARE, WARM_SHARE = 0.6, 0.9     # доля бюджета под горячие и горячие+тёплые
+VOL_BARS = 30
+NEW_SYMBOL_COST = 4                  # первая загрузка: 1m + догрузка старших таймфреймов
+UNIVERSE_COST = 2                    # exchangeInfo + ticker/24hr
+MIN_TICK_SEC = 5.0                   # как минимальный tick_interval_sec автоторговли
+
+HOT, WARM, COLD = "hot", "warm", "cold"
+PERIOD = {HOT: 0.0, WARM: WARM_SEC, COLD: COLD_SEC}
+
+
+def _volatility(symbol: str) -> float:
+    # стандартное отклонение минутных лог-доходностей за последние VOL_BARS баров
+    sc = candle_feed.symbols.get(symbol)
+    if sc is None or len(sc.m1) < 3:
+        return 0.0
+    closes = [b.c for b in list(sc.m1)[-(VOL_BARS + 1):] if b.c > 0]
+    rets = [math.log(b / a) for a, b in zip(closes, closes[1:])]
+    if len(rets) < 2:
+        return 0.0
+    mean = sum(rets) / len(rets)
+    return math.sqrt(sum((r - mean) ** 2 for r in rets) / (len(rets) - 1))
+
+
+def _pct_ranks(values: Dict[str, float]) -> Dict[str, float]:
+    # ранги в [0, 1]: устойчиво к разному масштабу объёма и волатильности;
+    # равные значения (нет данных — 0) получают общий средний ранг, а не ранг по порядку в списке
+    order = sorted(values, key=values.get)
+    n = max(1, len(order) - 1)
+    out: Dict[str, float] = {}
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for s in order[i: j + 1]:
+            out[s] = (i + j) / 2 / n
+        i = j + 1
+    return out
+
+
+class SymbolScheduler:
+    def __init__(self, budget_per_min: float = BUDGET_PER_MIN):
+        self.budget = float(budget_per_min)
+        self.tokens = self.budget
+        self.refilled_at = time.time()
+        self.qvol: Dict[str, float] = {}
+        self.polled_at: Dict[str, float] = {}
+        self.tier: Dict[str, str] = {}
+        self.ticks_per_min = 2.0         # частота тиков: из интервала автоторговли или медиана последних
+        self._last_plan = 0.0
+        self._intervals: deque = deque(maxlen=9)
+        self._universe: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._qvol_at: Dict[str, float] = {}   # котировка -> когда подтянули quoteVolume
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.budget, self.tokens + (now - self.refilled_at) * self.budget / 60.0)
+        self.refilled_at = now
+
+    def spend(self, n: float) -> None:
+        self.tokens -= n
+
+    async def universe(self, quote: str, n: int) -> List[str]:
+        """Top-N по ликвидности; обновляется раз в UNIVERSE_REFRESH_SEC, при ошибке — прежний список."""
+        key = (quote.upper(), int(n))
+        hit = self._universe.get(key)
+        now = time.time()
+        if hit and now - hit[0] < UNIVERSE_REFRESH_SEC:
+            return hit[1]
+        try:
+            self._refill(now)
+            self.spend(UNIVERSE_COST)
+            rows = await top_by_quote(quote)
+        except Exception:
+            if hit:
+                return hit[1]
+            raise
+        self.qvol.update(rows)
+        syms = [s for s, _ in rows[: max(1, min(int(n), 200))]]
+        self._universe[key] = (now, syms)
+        return syms
+
+    async def refresh_liquidity(self, quotes: Iterable[str]) -> None:
+        """quoteVolume всех символов котировки (кэш top_by_quote) — для тиров и без universe_top_n."""
+        now = time.time()
+        for quote in sorted({q.upper() for q in quotes}):
+            if now - self._qvol_at.get(quote, 0.0) < UNIVERSE_REFRESH_SEC:
+                continue
+            self._qvol_at[quote] = now   # и при ошибке: не повторяем тяжёлый запрос каждый тик
+            try:
+                self._refill(now)
+                self.spend(UNIVERSE_COST)
+                rows = await top_by_quote(quote)
+            except Exception:
+                continue
+            self.qvol.update(rows)
+
+    @staticmethod
+    def _cost(symbol: str) -> int:
+        return 1 if symbol in candle_feed.symbols else NEW_SYMBOL_COST
+
+    def _assign_tiers(self, symbols: List[str], held: Set[str]) -> None:
+        liq = _pct_ranks({s: self.qvol.get(s, 0.0) for s in symbols})
+        vol = _pct_ranks({s: _volatility(s) for s in symbols})
+        # при равном ранге первым — тот, кого дольше не опрашивали: тиры не зависят от порядка allowed_symbols
+        ranked = sorted(symbols, key=lambda s: (s not in held, -(liq[s] + vol[s]), self.polled_at.get(s, 0.0)))
+        self.tier = {}
+        used = 0.0
+        for s in ranked:
+            if s in held or used + self.ticks_per_min <= HOT_SHARE * self.budget:
+                self.tier[s] = HOT
+                used += self.ticks_per_min
+            elif used + 60.0 / WARM_SEC <= WARM_SHARE * self.budget:
+                self.tier[s] = WARM
+                used += 60.0 / WARM_SEC
+            else:
+                self.tier[s] = COLD
+                used += 60.0 / COLD_SEC
+
+    def _update_rate(self, now: float, interval: float | None) -> None:
+        if self._last_plan:
+            self._intervals.append(max(MIN_TICK_SEC, now - self._last_plan))
+        self._last_plan = now
+        if interval:
+            # автоторговля задаёт ритм; внеочередные /tick на размер тиров не влияют
+            self.ticks_per_min = 60.0 / max(MIN_TICK_SEC, interval)
+        elif self._intervals:
+            # только ручные тики: медиана устойчива к единичному внеочередному вызову
+            self.ticks_per_min = 60.0 / statistics.median(self._intervals)
+
+    def plan(self, symbols: Iterable[str], held: Set[str], interval: float | None = None) -> List[str]:
+        """Какие символы опросить в этом тике. Символы с позицией — всегда, даже сверх бюджета.
+        interval — период автоторговли (сек), если она включена."""
+        now = time.time()
+        self._update_rate(now, interval)
+        self._refill(now)
+
+        symbols = list(dict.fromkeys(symbols))
+        self._assign_tiers(symbols, held)
+        avail = self.tokens
+        out = [s for s in symbols if s in held]
+        for s in out:
+            avail -= self._cost(s)
+
+        due = []
+        for s in symbols:
+            if s in held:
+                continue
+            last = self.polled_at.get(s)
+            # ещё не опрошенные — первыми в своём тире
+            overdue = math.inf if last is None else now - last - PERIOD[self.tier[s]]
+            if overdue >= 0:
+                due.append(({HOT: 0, WARM: 1, COLD: 2}[self.tier[s]], -overdue, s))
+        # сначала горячие, внутри тира — кто дольше ждёт
+        for _, _, s in sorted(due):
+            cost = self._cost(s)
+            if avail < cost:
+                continue
+            avail -= cost
+            out.append(s)
+        for s in out:
+            self.polled_at[s] = now
+        return out
+
+    def status(self) -> Dict[str, Any]:
+        counts = {HOT: 0, WARM: 0, COLD: 0}
+        for t in self.tier.values():
+            counts[t] += 1
+        return {
+            "budget_per_min": self.budget,
+            "tokens": round(self.tokens, 2),
+            "ticks_per_min": round(self.ticks_per_min, 2),
+            "tiers": counts,
+        }
+
+
+symbol_scheduler = SymbolScheduler()
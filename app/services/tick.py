@@ -1,15 +1,17 @@
 from __future__ import annotations
 from pathlib import Path
 from datetime import datetime, timezone
-import json, math, time
-import httpx
+import asyncio, json, math, time
+from app.services.execution import get_engine, live_allowed
+from app.services.prices import price_cache
+from app.services.candles import candle_feed, TF_MIN
+from app.services.portfolios import PortfolioGone, list_portfolios, portfolio_lock
+from app.utils.storage import write_json_atomic
+from app.services import history
+from app.services.events import bus
+from app.services.risk import risk_engine, risk_sized_notional, cache_marks
+from app.services.scheduler import symbol_scheduler
 
-ROOT = Path(__file__).resolve().parents[1]
-DB = ROOT / "db"
-F_SET = DB / "settings.json"
-F_OPEN = DB / "trades_open.json"
-F_CLOSED = DB / "trades_closed.json"
-F_SUM = DB / "trades_summary.json"
 
 def _rj(p: Path, default):
     if not p.exists(): return default
@@ -18,24 +20,11 @@ def _rj(p: Path, default):
     except Exception: return default
 
 def _wj(p: Path, data):
-    with p.open("w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_atomic(p, data, indent=2)
 
 def _now_iso():
     return datetime.now(timezone.utc).isoformat()
 
-def _binance_interval(tf: str) -> str:
-    return tf if tf in {"1m","5m","15m"} else "1m"
-
-async def _fetch_klines_async(symbol: str, tf: str, limit: int = 80):
-    url = "https://api.binance.com/api/v3/klines"
-    params = {"symbol": symbol, "interval": _binance_interval(tf), "limit": limit}
-    async with httpx.AsyncClient(timeout=10.0) as cli:
-        r = await cli.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
-        # close price = [4]
-        return [float(x[4]) for x in data]
-
 def _sma(xs, n):
     if len(xs) < n: return None
     return sum(xs[-n:]) / n
@@ -69,117 +58,232 @@ def _apply_pnl_to_summary(sumfile, pnl):
     sumfile["adjustment_usdc"] = round(adj, 6)
     sumfile["effective_max_usdc_exposure"] = round(sumfile.get("base_exposure_usdc",0.0) + adj, 6)
 
-def run_tick():
-    # загрузка данных
-    settings = _rj(F_SET, {})
-    if not settings:
-        return {"processed":0,"opened":0,"closed":0,"errors":["no settings"]}
+async def _execute_live(exits, entries, errors):
+    # выходы и входы тика отправляются одной пачкой параллельно
+    engine = await get_engine()
+    orders = [{"symbol": t["symbol"], "side": "BUY" if t.get("side") == "SELL" else "SELL",
+               "qty": float(t["qty"]), "price_hint": price} for t, price in exits]
+    orders += [{"symbol": sym, "side": "BUY", "quote_qty": notional, "price_hint": price} for sym, notional, price in entries]
+    res = await engine.execute_many(orders)
+    exit_fills, entry_fills = [], []
+    for i, r in enumerate(res):
+        sym = orders[i]["symbol"]
+        if isinstance(r, Exception):
+            errors.append(f"{sym}: {r}")
+            continue
+        if not r["executed_qty"] or r["avg_price"] is None:
+            errors.append(f"{sym}: order {r['status']}")
+            continue
+        if i < len(exits):
+            exit_fills.append((exits[i][0], r["avg_price"], r))
+        else:
+            entry_fills.append((sym, r["net_qty"], r["avg_price"], r["quote_qty"], r))
+    return exit_fills, entry_fills
 
-    if settings.get("trade_mode","paper") != "paper":
-        return {"processed":0,"opened":0,"closed":0,"errors":["mode is not paper"]}
+# стратегии: имя -> функция(closes) -> "BUY" | "SELL" | None
+STRATEGIES = {"sma_cross": _signal}
+SIGNAL_BARS = 80
+CATCHUP_BARS = 60   # сколько баров назад догоняем сигнал у символа, который давно не опрашивали
 
-    symbols = settings.get("allowed_symbols", [])
-    if not symbols:
-        return {"processed":0,"opened":0,"closed":0,"errors":["no symbols"]}
+# (символ, таймфрейм, стратегия) -> open time последнего оценённого бара
+_evaluated = {}
 
-    tf = settings.get("timeframe","1m")
-    max_open = int(settings.get("max_open_positions",1))
-    base_limit = float(settings.get("max_usdc_exposure",100.0))
-    pos_cap = float(settings.get("max_position_size_usdc",25.0))
-    risk_pct = float(settings.get("risk_per_trade_pct",0.5))  # пока не используется детально
+def _eval_signal(key, bars):
+    """Сигнал по всем барам с прошлой оценки, а не только по последнему: тёплые/холодные символы
+    опрашиваются раз в минуты, и пересечение на 1m/5m могло случиться между опросами. Берём последний."""
+    fn = STRATEGIES[key[2]]
+    closes = [b.c for b in bars]
+    start = len(bars) - 1
+    last_t = _evaluated.get(key)
+    if last_t is not None:
+        # последний оценённый бар тоже: тогда он мог быть ещё незавершённым
+        while start > 0 and bars[start - 1].t >= last_t and len(bars) - start < CATCHUP_BARS:
+            start -= 1
+    sig = None
+    for i in range(start, len(bars)):
+        s = fn(closes[max(0, i + 1 - SIGNAL_BARS): i + 1])
+        if s is not None:
+            sig = s
+    _evaluated[key] = bars[-1].t
+    return sig, float(closes[-1])
 
-    open_trades = _rj(F_OPEN, [])
-    closed_trades = _rj(F_CLOSED, [])
-    summary = _rj(F_SUM, {
+def _settings_error(settings):
+    if not settings:
+        return "no settings"
+    mode = settings.get("trade_mode","paper")
+    if mode not in ("paper", "live"):
+        return f"unknown mode {mode}"
+    if mode == "live" and not live_allowed():
+        return "live disabled: set TRADE_MODE=live and LIVE_ENABLED=true"
+    if settings.get("strategy","sma_cross") not in STRATEGIES:
+        return f"unknown strategy {settings.get('strategy')}"
+    if not settings.get("allowed_symbols") and not int(settings.get("universe_top_n",0) or 0):
+        return "no symbols"
+    return None
+
+def _exit_price(t, signals, tf, strategy):
+    # закрываем по bid для лонга / ask для шорта; иначе последняя цена сигнала; иначе цена входа
+    p = price_cache.price(t["symbol"], "BUY" if t.get("side") == "SELL" else "SELL")
+    if not p:
+        item = signals.get((t["symbol"], tf, strategy))
+        p = item[1] if item else float(t["entry_price"])
+    return p
+
+def _default_summary(settings):
+    base_limit = float(settings.get("max_usdc_exposure",100.0))
+    return {
         "open_count": 0, "closed_count": 0,
         "realized_pnl_usdc_total": 0.0, "realized_pnl_usdc_today": 0.0,
         "win_rate": 0.0, "avg_pnl_usdc": 0.0, "max_drawdown_usdc": 0.0,
         "base_exposure_usdc": base_limit, "adjustment_usdc": 0.0,
         "effective_max_usdc_exposure": base_limit, "reinvest_profit_pct": float(settings.get("reinvest_profit_pct",0.0))
-    })
+    }
 
-    opened = 0; closed = 0; errors = []
-    import asyncio
-    async def process_symbol(sym):
-        try:
-            prices = await _fetch_klines_async(sym, tf, 80)
-        except Exception as e:
-            errors.append(f"{sym}: {e}")
-            return None
-        sig = _signal(prices)
-        price = float(prices[-1])
-        return (sym, sig, price)
+async def _run_portfolio(pf, settings, signals):
+    # один тик/закрытие на портфель за раз (kill switch может сработать посреди тика),
+    # и ни один воркер не пишет файлы портфеля между нашим чтением и записью
+    try:
+        async with portfolio_lock(pf):
+            return await _run_portfolio_locked(pf, settings, signals)
+    except PortfolioGone:
+        return {"processed": 0, "opened": 0, "closed": 0, "errors": ["portfolio deleted"]}
+
+async def _run_portfolio_locked(pf, settings, signals):
+    # риск/позиции одного портфеля поверх общих сигналов тика; закрытие по kill switch идёт мимо
+    # _settings_error, поэтому живой режим проверяем и здесь
+    live = settings.get("trade_mode","paper") == "live" and live_allowed()
+    symbols = settings.get("allowed_symbols", [])
+    tf = settings.get("timeframe","1m")
+    strategy = settings.get("strategy","sma_cross")
+    max_open = int(settings.get("max_open_positions",1))
+    base_limit = float(settings.get("max_usdc_exposure",100.0))
+    pos_cap = float(settings.get("max_position_size_usdc",25.0))
+    risk_pct = float(settings.get("risk_per_trade_pct",0.5))
+    stop_pct = float(settings.get("stop_distance_pct",1.0))
 
-    # Параллельно тянем цены
-    results = asyncio.run(asyncio.gather(*[process_symbol(s) for s in symbols]))
+    open_trades = _rj(pf.f_open, [])
+    summary = _rj(pf.f_sum, None) or _default_summary(settings)
+
+    opened = 0; closed = 0; errors = []
     # Индекс открытых по символу
     open_by_symbol = {t["symbol"]: t for t in open_trades}
     exposure_now = _current_exposure(open_trades)
     eff_limit = float(summary.get("effective_max_usdc_exposure", base_limit))
 
-    for item in results:
+    # дневной PnL по свежим ценам; лимит мог быть пробит между тиками
+    marks = cache_marks(open_trades)
+    for t in open_trades:
+        item = signals.get((t["symbol"], tf, strategy))
+        if item and t["symbol"] not in marks:
+            marks[t["symbol"]] = item[1]
+    # пробой здесь обрабатывает сам тик (ниже закрываем всё), отдельное закрытие не нужно
+    pr = risk_engine.sync(pf, open_trades, summary, settings, marks, notify=False)
+    # размер входа: risk_per_trade_pct от экспозиции при срабатывании стопа в stop_distance_pct
+    entry_cap = risk_sized_notional(eff_limit, risk_pct, stop_pct, pos_cap)
+
+    # сначала решаем, что закрыть и что открыть, затем исполняем всё разом
+    exits, entries = [], []
+    open_now = len(open_trades)
+    if pr.killed:
+        # kill switch: новых входов нет, закрываем всё
+        exits = [(t, _exit_price(t, signals, tf, strategy)) for t in open_trades]
+        symbols_to_scan = []
+    else:
+        symbols_to_scan = symbols
+    for sym in symbols_to_scan:
+        item = signals.get((sym, tf, strategy))
         if not item: continue
-        sym, sig, price = item
+        sig, price = item
         if sig is None: continue
 
         has_open = sym in open_by_symbol
         # SELL — закрыть, если есть
         if sig == "SELL" and has_open:
             t = open_by_symbol[sym]
-            qty = float(t["qty"])
-            entry = float(t["entry_price"])
-            side = t.get("side","BUY")
             # допустим только long BUY → закрытие по SELL
-            if side == "BUY":
-                pnl = (price - entry) * qty
-                closed_trades.insert(0, {
-                    "id": t["id"], "symbol": sym, "side": "BUY", "qty": qty,
-                    "entry_price": entry, "exit_price": price,
-                    "notional_usdc": t["notional_usdc"],
-                    "pnl_usdc": round(pnl, 6),
-                    "pnl_pct": round((pnl / max(1e-9, t["notional_usdc"])) * 100.0, 4),
-                    "entry_time": t["entry_time"], "exit_time": _now_iso(),
-                    "duration_sec": (datetime.fromisoformat(_now_iso()) - datetime.fromisoformat(t["entry_time"])).total_seconds()
-                })
-                open_trades = [x for x in open_trades if x["symbol"] != sym]
-                open_by_symbol.pop(sym, None)
-                exposure_now = _current_exposure(open_trades)
-                _apply_pnl_to_summary(summary, pnl)
-                closed += 1
+            if t.get("side","BUY") == "BUY":
+                exits.append((t, price))
+                open_now -= 1
+                exposure_now -= float(t.get("notional_usdc",0.0))
             continue
 
         # BUY — открыть, если нет и хватает лимитов
         if sig == "BUY" and not has_open:
-            if len(open_trades) >= max_open:
+            if open_now >= max_open:
                 continue
             remaining = eff_limit - exposure_now
             if remaining <= 1e-6:
                 continue
-            notional = float(min(pos_cap, remaining))
-            qty = _qty_from_notional(notional, price)
-            trade = {
-                "id": f"T{int(time.time()*1000)}", "symbol": sym, "side": "BUY",
-                "qty": qty, "entry_price": price, "notional_usdc": notional,
-                "entry_time": _now_iso()
-            }
-            open_trades.append(trade)
-            open_by_symbol[sym] = trade
-            exposure_now = _current_exposure(open_trades)
-            opened += 1
+            # стоп по этому входу не должен выводить за дневной лимит убытка
+            notional = float(min(entry_cap, remaining, pr.entry_budget() * 100.0 / max(stop_pct, 1e-9)))
+            if notional <= 1e-6:
+                continue
+            entries.append((sym, notional, price))
+            open_now += 1
+            exposure_now += notional
+
+    if live:
+        try:
+            exit_fills, entry_fills = await _execute_live(exits, entries, errors)
+        except Exception as e:
+            errors.append(f"execution: {e}")
+            exit_fills, entry_fills = [], []
+    else:
+        exit_fills = [(t, price, None) for t, price in exits]
+        entry_fills = [(sym, _qty_from_notional(notional, price), price, notional, None) for sym, notional, price in entries]
+
+    closed_rows = []
+    for t, price, fill in exit_fills:
+        sym = t["symbol"]
+        side = t.get("side","BUY")
+        qty = float(t["qty"])
+        entry = float(t["entry_price"])
+        pnl = (price - entry) * qty if side == "BUY" else (entry - price) * qty
+        row = {
+            "id": t["id"], "symbol": sym, "side": side, "qty": qty,
+            "entry_price": entry, "exit_price": price,
+            "notional_usdc": t["notional_usdc"],
+            "pnl_usdc": round(pnl, 6),
+            "pnl_pct": round((pnl / max(1e-9, t["notional_usdc"])) * 100.0, 4),
+            "entry_time": t["entry_time"], "exit_time": _now_iso(),
+            "duration_sec": (datetime.fromisoformat(_now_iso()) - datetime.fromisoformat(t["entry_time"])).total_seconds()
+        }
+        if fill:
+            row["exit_order_id"] = fill["order_id"]
+        closed_rows.append(row)
+        open_trades = [x for x in open_trades if x["id"] != t["id"]]
+        _apply_pnl_to_summary(summary, pnl)
+        closed += 1
+
+    for sym, qty, price, notional, fill in entry_fills:
+        trade = {
+            "id": f"T{int(time.time()*1000)}{sym}", "symbol": sym, "side": "BUY",
+            "qty": qty, "entry_price": price, "notional_usdc": round(notional, 6),
+            "entry_time": _now_iso()
+        }
+        if fill:
+            trade["entry_order_id"] = fill["order_id"]
+        open_trades.append(trade)
+        opened += 1
+
+    _wj(pf.f_open, open_trades)
+    # закрытые — в историю, она же инкрементально ведёт роллапы для сводки
+    meta = history.record_closed(pf, closed_rows) if closed_rows else history.load_meta(pf, migrate=True)
 
     # обновляем сводку
     summary["open_count"] = len(open_trades)
-    summary["closed_count"] = len(closed_trades)
-    # win-rate/avg pnl (по закрытым)
-    if closed_trades:
-        wins = sum(1 for t in closed_trades if t["pnl_usdc"] > 0)
-        summary["win_rate"] = round(100.0 * wins / len(closed_trades), 2)
-        summary["avg_pnl_usdc"] = round(sum(t["pnl_usdc"] for t in closed_trades) / len(closed_trades), 6)
+    summary.update(history.summary_fields(meta))
     summary["last_tick_ts"] = _now_iso()
+    # пересобираем риск по новому состоянию; kill switch переживает рестарт до конца дня (UTC)
+    pr = risk_engine.sync(pf, open_trades, summary, settings, cache_marks(open_trades))
+    summary["kill_switch"] = pr.kill_record()
+    _wj(pf.f_sum, summary)
 
-    _wj(F_OPEN, open_trades)
-    _wj(F_CLOSED, closed_trades)
-    _wj(F_SUM, summary)
+    for row in closed_rows:
+        bus.publish("position.close", {"portfolio": pf.id, "trade": row})
+    for trade in open_trades[len(open_trades) - opened:]:
+        bus.publish("position.open", {"portfolio": pf.id, "trade": trade})
+    bus.publish_summary(pf.id, summary)
 
     return {
         "processed": len(symbols),
@@ -188,5 +292,121 @@ def run_tick():
         "errors": errors,
         "effective_limit": summary["effective_max_usdc_exposure"],
         "open_now": len(open_trades),
+        "risk": pr.status(),
         "last_tick_ts": summary["last_tick_ts"]
     }
+
+def _load_runs():
+    runs, skipped = [], {}
+    for pf in list_portfolios():
+        settings = _rj(pf.f_set, {})
+        err = _settings_error(settings)
+        if err:
+            skipped[pf.id] = err
+        else:
+            runs.append((pf, settings))
+    return runs, skipped
+
+def sync_risk():
+    # полная загрузка риска по всем портфелям (при избрании лидером)
+    for pf in list_portfolios():
+        open_trades = _rj(pf.f_open, [])
+        pr = risk_engine.sync(pf, open_trades, _rj(pf.f_sum, {}), _rj(pf.f_set, {}), cache_marks(open_trades))
+        if pr.killed and open_trades and not pr.unpersisted:
+            # kill switch взведён, а позиции остались (прежний лидер не успел закрыть)
+            asyncio.create_task(flatten_portfolio(pf.id))
+
+async def flatten_portfolio(pid, kill=None):
+    """Kill switch: закрыть все позиции портфеля сразу, не дожидаясь следующего тика."""
+    pf = next((p for p in list_portfolios() if p.id == pid), None)
+    if pf is None:
+        return None
+    try:
+        async with portfolio_lock(pf):
+            settings = _rj(pf.f_set, {})
+            if kill:
+                # сначала фиксируем пробой в сводке (и когда её ещё нет): её читают все воркеры
+                # и следующая пересборка риска, иначе kill switch потеряется
+                summary = _rj(pf.f_sum, None) or _default_summary(settings)
+                summary["kill_switch"] = kill
+                _wj(pf.f_sum, summary)
+            bus.publish("risk.kill", {"portfolio": pid, **(kill or risk_engine.status(pid) or {})})
+            return await _run_portfolio_locked(pf, settings, {})
+    except PortfolioGone:
+        return None
+
+async def run_tick():
+    # портфели с валидными настройками; остальные пропускаем с причиной
+    runs, skipped = _load_runs()
+    errors = [f"{pid}: {e}" for pid, e in skipped.items()]
+    if not runs:
+        return {"processed":0,"opened":0,"closed":0,"errors":errors,"portfolios":{}}
+
+    # вселенная: allowed_symbols + автообновляемый top-N по ликвидности; символы с позициями — всегда
+    held = set()
+    for pf, settings in runs:
+        pf_held = [t["symbol"] for t in _rj(pf.f_open, [])]
+        held.update(pf_held)
+        n = int(settings.get("universe_top_n",0) or 0)
+        if n > 0:
+            try:
+                uni = await symbol_scheduler.universe(settings.get("universe_quote","USDC"), n)
+            except Exception as e:
+                errors.append(f"{pf.id}: universe: {e}")
+                uni = []
+            # символ, выпавший из топа, остаётся в работе, пока по нему открыта позиция
+            settings["allowed_symbols"] = list(dict.fromkeys([*settings.get("allowed_symbols", []), *uni, *pf_held]))
+
+    # объединение по всем портфелям: символ -> таймфреймы, и уникальные (символ, таймфрейм, стратегия)
+    tfs_by_symbol, keys = {}, set()
+    for pf, settings in runs:
+        tf = settings.get("timeframe","1m")
+        strategy = settings.get("strategy","sma_cross")
+        for sym in settings.get("allowed_symbols", []):
+            tfs_by_symbol.setdefault(sym, set()).add(tf)
+            keys.add((sym, tf, strategy))
+
+    async def process_symbol(sym, tfs):
+        try:
+            # один 1m-поток на символ на весь процесс, таймфреймы собираются локально
+            sc = await candle_feed.sync(sym, tfs, SIGNAL_BARS)
+        except Exception as e:
+            errors.append(f"{sym}: {e}")
+            return None
+        if sc.m1:
+            price_cache.update_last(sym, sc.m1[-1].c)
+        return sym, sc
+
+    # опрашиваем не всё подряд: планировщик выбирает символы по тирам в пределах бюджета запросов
+    intervals = [float(s.get("tick_interval_sec", 30)) for _, s in runs if s.get("autotrade_enabled")]
+    # ликвидность для тиров — по всем символам, а не только когда задан universe_top_n
+    await symbol_scheduler.refresh_liquidity({s.get("universe_quote","USDC") for _, s in runs})
+    poll = symbol_scheduler.plan(tfs_by_symbol, held, min(intervals) if intervals else None)
+    before = candle_feed.requests
+    # Параллельно тянем цены — каждый символ ровно один раз
+    fetched = dict(x for x in await asyncio.gather(*[process_symbol(s, tfs_by_symbol[s]) for s in poll]) if x)
+    symbol_scheduler.spend(candle_feed.requests - before)
+
+    # сигнал считается один раз на (символ, таймфрейм, стратегия)
+    signals = {}
+    for sym, tf, strategy in keys:
+        sc = fetched.get(sym)
+        if sc is None: continue
+        bars = sc.bars(tf if tf in TF_MIN else "1m")[-(SIGNAL_BARS + CATCHUP_BARS):]
+        if not bars: continue
+        signals[(sym, tf, strategy)] = _eval_signal((sym, tf, strategy), bars)
+
+    results = await asyncio.gather(*[_run_portfolio(pf, settings, signals) for pf, settings in runs])
+    per_pf = {pf.id: r for (pf, _), r in zip(runs, results)}
+    for pid, r in per_pf.items():
+        errors += [f"{pid}: {e}" for e in r["errors"]]
+    out = {
+        "processed": len(fetched),
+        "deferred": len(tfs_by_symbol) - len(poll),
+        "opened": sum(r["opened"] for r in results),
+        "closed": sum(r["closed"] for r in results),
+        "errors": errors,
+        "portfolios": per_pf,
+    }
+    bus.publish("tick", out, key="tick")
+    return out
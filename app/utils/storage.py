@@ -1,25 +1,56 @@
 from __future__ import annotations
-import json, os
-from typing import Optional
+import json, os, tempfile
+from pathlib import Path
+from typing import Any, Dict, Tuple
 from app.models import Settings
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "db", "settings.json")
 
 DEFAULT = Settings().model_dump()
 
+# кэш настроек по пути файла: файл перечитывается только при изменении mtime
+_cache: Dict[str, Tuple[int, Settings]] = {}
+
+def write_json_atomic(p: Path | str, data: Any, **dump_kw: Any) -> None:
+    """Запись через уникальный tmp в той же папке + os.replace: читатели не видят полузаписанный файл,
+    а параллельные писатели (потоки, воркеры) не делят один tmp."""
+    p = Path(p)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    dump_kw.setdefault("ensure_ascii", False)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=p.parent, prefix=p.name + ".",
+                                     suffix=".tmp", delete=False) as f:
+        try:
+            json.dump(data, f, **dump_kw)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, p)
+
 def ensure_db() -> None:
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     if not os.path.exists(DB_PATH):
         with open(DB_PATH, "w", encoding="utf-8") as f:
             json.dump(DEFAULT, f, ensure_ascii=False, indent=2)
 
-def load_settings() -> Settings:
-    ensure_db()
-    with open(DB_PATH, "r", encoding="utf-8") as f:
+def load_settings(p: Path | str) -> Settings:
+    """Настройки портфеля (его settings.json); нет файла — значения по умолчанию."""
+    key = str(p)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except FileNotFoundError:
+        return Settings()
+    hit = _cache.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    with open(key, "r", encoding="utf-8") as f:
         data = json.load(f)
-    return Settings(**data)
+    s = Settings(**data)
+    _cache[key] = (mtime, s)
+    return s
 
 def save_settings(s: Settings) -> None:
     ensure_db()
     with open(DB_PATH, "w", encoding="utf-8") as f:
         json.dump(s.model_dump(), f, ensure_ascii=False, indent=2)
+    _cache[DB_PATH] = (os.stat(DB_PATH).st_mtime_ns, s)
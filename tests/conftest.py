@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+
+import app.services.portfolios as portfolios
+from app.services.exchange_stub import StubExchange
+from app.services.execution import ExecutionEngine
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def stub():
+    return StubExchange()
+
+
+@pytest.fixture
+def engine(stub):
+    eng = ExecutionEngine(stub.client())
+    stub.subscribe(eng.tracker.on_event)
+    yield eng
+    run(eng.client.close())
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # файлы портфелей — во временной папке, а не в app/db
+    monkeypatch.setattr(portfolios, "DB", tmp_path)
+    monkeypatch.setattr(portfolios, "PF_DIR", tmp_path / "portfolios")
+    return tmp_path
@@ -0,0 +1,90 @@
+import pytest
+
+import app.services.execution as execution
+from app.services.exchange_stub import StubExchange
+from app.services.execution import BinanceClient, ExchangeError, OrderError
+from tests.conftest import run
+
+
+def test_bad_signature_rejected(stub):
+    client = BinanceClient(stub.key, "wrong-secret", "http://exchange-stub", transport=stub.transport())
+    with pytest.raises(ExchangeError) as e:
+        run(client.signed("GET", "/api/v3/order", {"origClientOrderId": "x"}))
+    assert e.value.code == -1022
+    run(client.close())
+
+
+def test_timestamp_outside_recv_window_resyncs_and_retries(stub, engine):
+    async def go():
+        await engine.client.sync_time()
+        stub.clock_skew_ms = 120_000   # часы биржи ушли вперёд после синхронизации
+        return await engine.market_order("BTCUSDC", "BUY", qty=0.001)
+
+    r = run(go())
+    assert r["status"] == "FILLED"
+    assert stub.requests.count("GET /api/v3/time") == 2
+    assert stub.requests.count("POST /api/v3/order") == 2
+
+
+def test_qty_rounded_down_to_lot_step(stub, engine):
+    r = run(engine.market_order("BTCUSDC", "BUY", qty=0.123456789))
+    assert stub.orders[r["client_order_id"]]["origQty"] == "0.12345"
+    assert r["executed_qty"] == 0.12345
+
+
+def test_below_min_qty_rejected_locally(stub, engine):
+    with pytest.raises(OrderError, match="LOT_SIZE"):
+        run(engine.market_order("BTCUSDC", "BUY", qty=0.000001))
+    assert "POST /api/v3/order" not in stub.requests
+
+
+def test_below_min_notional_rejected_locally(stub, engine):
+    with pytest.raises(OrderError, match="notional"):
+        run(engine.market_order("SOLUSDC", "BUY", qty=0.01, price_hint=150.0))
+    with pytest.raises(OrderError, match="quote amount"):
+        run(engine.market_order("SOLUSDC", "BUY", quote_qty=1.0))
+    assert "POST /api/v3/order" not in stub.requests
+
+
+def test_quote_qty_buy_net_of_base_asset_fee(engine):
+    r = run(engine.market_order("ETHUSDC", "BUY", quote_qty=100.0))
+    assert r["executed_qty"] == 0.03333
+    # 0.1% комиссии в ETH: 0.03333 * 0.999 = 0.03329667 → вниз до шага 0.00001
+    assert r["net_qty"] == 0.03329
+    assert r["avg_price"] == 3000.0
+    assert engine.tracker.orders[r["client_order_id"]]["status"] == "FILLED"
+
+
+def test_execute_many_isolates_bad_symbol(engine):
+    res = run(engine.execute_many([
+        {"symbol": "BTCUSDC", "side": "BUY", "qty": 0.001},
+        {"symbol": "NOPEUSDC", "side": "BUY", "qty": 1.0},
+        {"symbol": "ETHUSDC", "side": "BUY", "quote_qty": 50.0},
+    ]))
+    assert res[0]["status"] == "FILLED"
+    assert isinstance(res[1], ExchangeError) and res[1].code == -1121
+    assert res[2]["status"] == "FILLED"
+
+
+@pytest.mark.parametrize("mode", ["503", "timeout"])
+def test_lost_order_response_is_reconciled(stub, engine, mode, monkeypatch):
+    monkeypatch.setattr(execution, "RECONCILE_DELAY_SEC", 0.0)
+    stub.drop_responses, stub.drop_mode = 1, mode
+    r = run(engine.market_order("ETHUSDC", "BUY", quote_qty=100.0))
+    assert r["status"] == "FILLED"
+    assert r["net_qty"] == 0.03329   # комиссия — из myTrades
+    assert "GET /api/v3/order" in stub.requests
+
+
+def test_order_never_placed_is_an_error(stub, engine, monkeypatch):
+    monkeypatch.setattr(execution, "RECONCILE_DELAY_SEC", 0.0)
+    monkeypatch.setattr(stub, "_new_order", lambda p: stub._err(503, -1007, "unknown"))
+    with pytest.raises(OrderError, match="not placed"):
+        run(engine.market_order("ETHUSDC", "BUY", quote_qty=100.0))
+
+
+def test_engine_refuses_exchange_when_live_disabled(monkeypatch):
+    monkeypatch.setattr(execution.config, "trade_mode", "paper")
+    monkeypatch.setattr(execution.config, "exchange_stub", False)
+    with pytest.raises(OrderError, match="live disabled"):
+        run(execution.get_engine())
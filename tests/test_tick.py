@@ -0,0 +1,98 @@
+import json
+import time
+
+import pytest
+
+import app.services.execution as execution
+import app.services.scheduler as scheduler
+import app.services.tick as tick
+from app.services.candles import CandleFeed, MINUTE_MS
+from app.services.portfolios import DEFAULT_ID, Portfolio
+from app.services.risk import RiskEngine
+from app.services.scheduler import SymbolScheduler
+from tests.conftest import run
+
+
+def _klines(closes):
+    # 1m-бары до текущей (незавершённой) минуты включительно
+    start = (int(time.time() * 1000) // MINUTE_MS - len(closes) + 1) * MINUTE_MS
+    return [[start + i * MINUTE_MS, c, c, c, c, 1.0, start + (i + 1) * MINUTE_MS - 1] for i, c in enumerate(closes)]
+
+
+@pytest.fixture
+def tick_env(db, monkeypatch):
+    # свежее состояние модулей тика; биржевые свечи — синтетические, с пересечением SMA20/60 вверх на последнем баре
+    closes = [100 - 0.05 * i for i in range(99)]
+    closes.append(closes[-1] + 40)
+    feed = CandleFeed()
+
+    async def fake_klines(symbol, tf, limit):
+        return _klines(closes) if tf == "1m" else []
+
+    async def no_top(quote, *a, **kw):
+        return []
+
+    monkeypatch.setattr(feed, "_klines", fake_klines)
+    monkeypatch.setattr(tick, "candle_feed", feed)
+    monkeypatch.setattr(tick, "symbol_scheduler", SymbolScheduler())
+    monkeypatch.setattr(tick, "risk_engine", RiskEngine())
+    monkeypatch.setattr(tick, "_evaluated", {})
+    monkeypatch.setattr(scheduler, "top_by_quote", no_top)
+    return closes
+
+
+def _write_settings(pf, **kw):
+    pf.dir.mkdir(parents=True, exist_ok=True)
+    pf.f_set.write_text(json.dumps({"trade_mode": "live", "allowed_symbols": ["TSTUSDC"], "max_daily_loss_usdc": 0, **kw}))
+
+
+def test_live_tick_opens_through_stub(tick_env, stub, engine, monkeypatch):
+    monkeypatch.setattr(execution.config, "trade_mode", "live")
+    monkeypatch.setattr(execution.config, "live_enabled", True)
+    monkeypatch.setattr(execution, "_engine", engine)
+    stub.set_price("TSTUSDC", tick_env[-1])
+    pf = Portfolio(DEFAULT_ID)
+    _write_settings(pf)
+
+    r = run(tick.run_tick())
+
+    assert r["errors"] == [] and r["opened"] == 1
+    (trade,) = json.loads(pf.f_open.read_text())
+    order = stub.orders[next(iter(stub.orders))]
+    assert trade["entry_order_id"] == order["orderId"]
+    # max_position_size_usdc=25 через quoteOrderQty; в позиции — количество за вычетом комиссии в базовом активе
+    assert float(order["cummulativeQuoteQty"]) <= 25.0
+    assert trade["qty"] == pytest.approx(float(order["executedQty"]) * 0.999, abs=1e-5)
+
+
+def test_live_tick_refused_without_live_enabled(tick_env, stub, engine, monkeypatch):
+    monkeypatch.setattr(execution.config, "trade_mode", "paper")
+    monkeypatch.setattr(execution, "_engine", engine)
+    pf = Portfolio(DEFAULT_ID)
+    _write_settings(pf)
+
+    r = run(tick.run_tick())
+
+    assert r["opened"] == 0 and "live disabled" in r["errors"][0]
+    assert not stub.orders
+
+
+def test_kill_switch_flatten_respects_live_gate(tick_env, stub, engine, monkeypatch):
+    monkeypatch.setattr(execution.config, "trade_mode", "paper")
+    monkeypatch.setattr(execution, "_engine", engine)
+    pf = Portfolio(DEFAULT_ID)
+    _write_settings(pf)
+    pf.f_open.write_text(json.dumps([{
+        "id": "T1", "symbol": "BTCUSDC", "side": "BUY", "qty": 0.001, "entry_price": 60000.0,
+        "notional_usdc": 60.0, "entry_time": "2026-01-01T00:00:00+00:00",
+    }]))
+    kill = {"active": True, "day": time.strftime("%Y-%m-%d", time.gmtime()), "reason": "test"}
+
+    r = run(tick.flatten_portfolio(DEFAULT_ID, kill))
+
+    # закрыто без сводки на диске и без ордера на бирже; kill switch записан
+    assert r["closed"] == 1
+    assert not stub.orders
+    (row,) = json.loads(pf.f_closed.read_text())
+    assert "exit_order_id" not in row
+    assert json.loads(pf.f_sum.read_text())["kill_switch"] == kill